@@ -0,0 +1,169 @@
+"""Benchmarks, run with `python -m rsstool.bench <name>`"""
+import asyncio
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+from rsstool.filters import FeedFilter
+
+
+def _random_phrase(rng, n_words):
+    return " ".join(
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9))) for _ in range(n_words)
+    )
+
+
+def _naive_filter(config, title):
+    if config["require_in_title"] and any(kw.lower() not in title.lower() for kw in config["require_in_title"]):
+        return False
+    if config["disallow_in_title"] and any(kw.lower() in title.lower() for kw in config["disallow_in_title"]):
+        return False
+    return True
+
+
+def bench_filter(n_titles=1_000, repeat=5):
+    """Title filtering cost as the number of disallowed phrases grows"""
+    rng = random.Random(0)
+    titles = [_random_phrase(rng, rng.randint(5, 15)) for _ in range(n_titles)]
+
+    print(f"{'keywords':>9} {'naive ms':>10} {'compiled ms':>12} {'compile ms':>11} {'speedup':>8}")
+    for n_keywords in [1, 10, 100, 1_000, 5_000]:
+        config = {"require_in_title": [], "disallow_in_title": [_random_phrase(rng, 2) for _ in range(n_keywords)]}
+
+        compile_s = min(timeit.repeat(lambda: FeedFilter(config), number=1, repeat=repeat))
+        feed_filter = FeedFilter(config)
+        naive_s = min(timeit.repeat(lambda: [_naive_filter(config, t) for t in titles], number=1, repeat=repeat))
+        compiled_s = min(timeit.repeat(lambda: [feed_filter.matches(title=t) for t in titles], number=1, repeat=repeat))
+
+        assert [_naive_filter(config, t) for t in titles] == [feed_filter.matches(title=t) for t in titles]
+        print(
+            f"{n_keywords:>9} {naive_s * 1000:>10.2f} {compiled_s * 1000:>12.2f} {compile_s * 1000:>11.2f}"
+            f" {naive_s / compiled_s:>7.1f}x"
+        )
+
+
+def _sample_rss(n_items):
+    items = "".join(
+        f"<item><title>Item {i}</title><link>http://localhost/{i}</link><description>{'words ' * 50}</description>"
+        f"<author>someone@example.com</author><pubDate>Mon, 07 Mar 2022 12:00:00 +0000</pubDate></item>"
+        for i in range(n_items)
+    )
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>Sample</title>{items}</channel></rss>'
+
+
+async def _serve_upstream(port, n_items):
+    from aiohttp import web
+
+    body = _sample_rss(n_items)
+    app = web.Application()
+    app.router.add_get("/feed", lambda _: web.Response(text=body, content_type="application/rss+xml"))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def _hammer(url, seconds, concurrency):
+    import aiohttp as ahttp
+
+    done = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client(session):
+        nonlocal done
+        while time.perf_counter() < deadline:
+            async with session.get(url) as response:
+                await response.read()
+                response.raise_for_status()
+            done += 1
+
+    async with ahttp.ClientSession() as session:
+        await asyncio.gather(*[client(session) for _ in range(concurrency)])
+    return done / seconds
+
+
+async def _bench_workers(worker_counts, seconds, concurrency, n_items):
+    upstream = await _serve_upstream(8601, n_items)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "DB_LOC": os.path.join(tmp, "rss.db"), "RSS_USERNAME": "bench", "RSS_PASSWORD": "bench"}
+        setup = (
+            "import asyncio, rsstool.initdb as i, rsstool.db_helper as db;"
+            "asyncio.run(i.run_migrations(list(i.migrations)));"
+            "asyncio.run(db.insert_feed('bench', 'combine', {'sources': ['http://127.0.0.1:8601/feed']}))"
+        )
+        subprocess.run([sys.executable, "-c", setup], env=env, check=True, capture_output=True)
+
+        print(f"{'workers':>8} {'req/s':>8}")
+        for workers in worker_counts:
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "rsstool.main:app", "--port", "8602", "--workers", str(workers)],
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                # skipcache so every request renders, which is the CPU-bound path that workers parallelize
+                url = "http://127.0.0.1:8602/api/v1/feed/bench?skipcache=true"
+                while True:
+                    try:
+                        await _hammer(url, 0.5, 1)
+                        break
+                    except OSError:
+                        await asyncio.sleep(0.2)
+                print(f"{workers:>8} {await _hammer(url, seconds, concurrency):>8.1f}")
+            finally:
+                server.terminate()
+                server.wait()
+    await upstream.cleanup()
+
+
+def bench_workers(worker_counts=(1, 2, 4), seconds=10, concurrency=32, n_items=200):
+    """Rendering throughput against a local upstream as the number of uvicorn workers grows"""
+    asyncio.run(_bench_workers(worker_counts, seconds, concurrency, n_items))
+
+
+_IMPORT_PROBE = """
+import resource, sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def bench_startup(repeat=5):
+    """Import time and peak RSS of an API process, with and without the ML stack loaded"""
+    scenarios = {
+        "api": ["rsstool.main"],
+        "api + ml stack": ["rsstool.main", "rsstool.ml_base"],
+    }
+    print(f"{'scenario':>15} {'import ms':>10} {'max rss MB':>11}")
+    for name, modules in scenarios.items():
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run(
+                [sys.executable, "-c", _IMPORT_PROBE, *modules], check=True, capture_output=True, text=True
+            ).stdout.split()
+            runs.append((float(out[0]), int(out[1])))
+        elapsed, max_rss = min(runs)
+        # ru_maxrss is in kilobytes on Linux
+        print(f"{name:>15} {elapsed * 1000:>10.0f} {max_rss / 1024:>11.1f}")
+
+
+BENCHMARKS = {
+    "filter": bench_filter,
+    "workers": bench_workers,
+    "startup": bench_startup,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        raise RuntimeError(f"must specify one of: {', '.join(BENCHMARKS)}")
+    BENCHMARKS[sys.argv[1]]()
@@ -0,0 +1,67 @@
+from typing import Dict, Optional
+import gzip
+
+# Optional: brotli and zstd bodies are only produced (and offered) when these are installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BROTLI_QUALITY = 9
+ZSTD_LEVEL = 12
+# Preferred encoding first, used to break ties between equal q-values
+ENCODINGS = ["br", "zstd", "gzip"]
+
+
+def compress_all(text: str) -> Dict[str, bytes]:
+    raw = text.encode("utf-8")
+    encoded = {"gzip": gzip.compress(raw, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(raw, quality=BROTLI_QUALITY)
+    if zstandard is not None:
+        encoded["zstd"] = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return encoded
+
+
+def decompress(encoded: Dict[str, bytes]) -> str:
+    return gzip.decompress(encoded["gzip"]).decode("utf-8")
+
+
+def _parse_accept_encoding(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in header.split(","):
+        name, *params = [p.strip() for p in part.split(";")]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.lower()] = q
+    return accepted
+
+
+def negotiate(accept_encoding: Optional[str], available: Dict[str, bytes]) -> Optional[str]:
+    """Picks which of the `available` encodings to send, or None for the uncompressed body"""
+    if not accept_encoding or not available:
+        return None
+    accepted = _parse_accept_encoding(accept_encoding)
+    wildcard_q = accepted.get("*", 0.0)
+
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, wildcard_q)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
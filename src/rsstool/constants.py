@@ -8,6 +8,14 @@ if DB_LOC is None:
     DB_LOC = parent / "rss.db"
 
 
+# Seconds to wait on a locked database, which matters when several workers share it
+DB_TIMEOUT = float(os.getenv("RSS_DB_TIMEOUT", 30))
+# How stale per-process state (cached feed rows, buffered access times) may get relative to other workers
+COHERENCE_INTERVAL = float(os.getenv("RSS_COHERENCE_INTERVAL", 1))
+# Background jobs (indexing, refreshes) claim a lease so only one worker runs each; it expires after this many seconds
+LEASE_TTL = float(os.getenv("RSS_LEASE_TTL", 5 * 60))
+
+
 MODELS_LOC = os.getenv("RSS_MODELS_LOC", None)
 if MODELS_LOC is None:
     parent = pathlib.Path(__file__).parent.parent.parent.absolute()
@@ -15,3 +23,38 @@ if MODELS_LOC is None:
 
 USERNAME = os.getenv("RSS_USERNAME", uuid.uuid4())
 PASSWORD = os.getenv("RSS_PASSWORD", uuid.uuid4())
+
+# Cached renders younger than the soft TTL are served as-is. Between the soft and hard TTL they are served
+# immediately while a background refresh runs. Past the hard TTL the reader waits for a fresh render, unless the
+# render fails and the last good render is younger than the stale-if-error TTL (0 disables that fallback).
+CACHE_SOFT_TTL = int(os.getenv("RSS_CACHE_SOFT_TTL", 15 * 60))
+CACHE_HARD_TTL = int(os.getenv("RSS_CACHE_HARD_TTL", 60 * 60))
+CACHE_STALE_IF_ERROR_TTL = int(os.getenv("RSS_CACHE_STALE_IF_ERROR_TTL", 7 * 24 * 60 * 60))
+
+# Fetched and parsed upstream sources are shared between feeds for this many seconds
+SOURCE_CACHE_TTL = int(os.getenv("RSS_SOURCE_CACHE_TTL", 5 * 60))
+SOURCE_CACHE_SIZE = int(os.getenv("RSS_SOURCE_CACHE_SIZE", 1000))
+
+# Upstream fetches time out after a multiple of the host's typical latency, within these bounds (seconds)
+FETCH_TIMEOUT_MIN = float(os.getenv("RSS_FETCH_TIMEOUT_MIN", 2))
+FETCH_TIMEOUT_MAX = float(os.getenv("RSS_FETCH_TIMEOUT_MAX", 20))
+FETCH_TIMEOUT_LATENCY_MULTIPLE = float(os.getenv("RSS_FETCH_TIMEOUT_LATENCY_MULTIPLE", 4))
+# Hosts whose recent error rate reaches this are skipped for CIRCUIT_COOLDOWN seconds
+CIRCUIT_ERROR_RATE = float(os.getenv("RSS_CIRCUIT_ERROR_RATE", 0.5))
+CIRCUIT_COOLDOWN = float(os.getenv("RSS_CIRCUIT_COOLDOWN", 60))
+
+# Max number of upstream fetches in flight (overall and per host) when batch jobs index digest feeds
+INDEX_CONCURRENCY = int(os.getenv("RSS_INDEX_CONCURRENCY", 4))
+INDEX_PER_HOST_CONCURRENCY = int(os.getenv("RSS_INDEX_PER_HOST_CONCURRENCY", 2))
+
+# `python -m rsstool.ml train --changed-only` skips feeds with fewer new items + clicks than this since their last train
+RETRAIN_MIN_CHANGES = int(os.getenv("RSS_RETRAIN_MIN_CHANGES", 10))
+
+# Retention, applied by `python -m rsstool.maintenance`. Scores older than SCORE_HISTORY_DAYS are thinned to the last
+# one per item per day (the latest score of every item is always kept). Items are archived once they are
+# ARCHIVE_MARGIN_DAYS older than the oldest window their digest shows.
+SCORE_HISTORY_DAYS = float(os.getenv("RSS_SCORE_HISTORY_DAYS", 7))
+ARCHIVE_MARGIN_DAYS = float(os.getenv("RSS_ARCHIVE_MARGIN_DAYS", 30))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("RSS_MAINTENANCE_BATCH_SIZE", 5000))
+# Free pages handed back to the filesystem per maintenance run (0 for all of them)
+INCREMENTAL_VACUUM_PAGES = int(os.getenv("RSS_INCREMENTAL_VACUUM_PAGES", 0))
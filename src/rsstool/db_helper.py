@@ -1,86 +1,186 @@
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
 import json
 import datetime as dt
 from collections import namedtuple
 import asyncio
+import time
 
 import aiosqlite as asql
 
-from rsstool.constants import DB_LOC
+from rsstool.constants import DB_LOC, DB_TIMEOUT, COHERENCE_INTERVAL, CACHE_HARD_TTL
 import rsstool.models as mdl
 
 
-async def maybe_get_cache(feed_id: str, skipcache: bool = False):
+def connect():
+    # Several workers may share the database file, so wait on locks rather than failing straight away
+    return asql.connect(DB_LOC, timeout=DB_TIMEOUT)
+
+
+async def enable_wal():
+    async with connect() as db:
+        await db.execute("PRAGMA journal_mode=WAL")
+
+
+# Feed rows are cached per process. Other processes signal changes to `feed` by bumping the 'feed' generation (see
+# the triggers in the 'add_coherence' migration), which is checked at most every COHERENCE_INTERVAL seconds.
+_feeds = {}
+_feeds_generation = None
+_feeds_checked = 0.0
+
+
+async def _check_feeds_generation(db):
+    global _feeds_generation, _feeds_checked
+
+    now = time.monotonic()
+    if now - _feeds_checked < COHERENCE_INTERVAL:
+        return
+    _feeds_checked = now
+
+    async with db.execute("SELECT value FROM cache_generation WHERE name = 'feed'") as cursor:
+        async for row in cursor:
+            if row[0] != _feeds_generation:
+                _feeds.clear()
+                _feeds_generation = row[0]
+
+
+# `value` is the uncompressed render, which is only stored for rows written before `encoded` existed
+CachedFeed = namedtuple("CachedFeed", ["value", "created", "encoded"])
+CACHE_ENCODINGS = ["gzip", "br", "zstd"]
+
+
+async def maybe_get_cache(feed_id: str, skipcache: bool = False, max_age: int = CACHE_HARD_TTL) -> Optional[CachedFeed]:
     if skipcache:
         return None
 
-    async with asql.connect(DB_LOC) as db:
-        params = {"id": feed_id, "min_dt": (dt.datetime.utcnow() - dt.timedelta(minutes=15)).timestamp()}
+    async with connect() as db:
+        params = {"id": feed_id, "min_dt": (dt.datetime.utcnow() - dt.timedelta(seconds=max_age)).timestamp()}
         async with db.execute(
-            "SELECT value FROM feed_cache WHERE feed_id = :id AND created >= :min_dt ORDER BY created DESC LIMIT 1",
+            """SELECT value, created, value_gzip, value_br, value_zstd
+            FROM feed_cache
+            WHERE feed_id = :id AND created >= :min_dt
+            ORDER BY created DESC
+            LIMIT 1""",
             params,
         ) as cursor:
             async for row in cursor:
-                return row[0]
+                return CachedFeed(
+                    value=row[0],
+                    created=dt.datetime.utcfromtimestamp(row[1]),
+                    encoded={enc: v for enc, v in zip(CACHE_ENCODINGS, row[2:]) if v is not None},
+                )
     return None
 
 
-async def save_to_cache(feed_id, rendered_feed: str):
-    async with asql.connect(DB_LOC) as db:
-        params = {"min_dt": (dt.datetime.utcnow() - dt.timedelta(minutes=15)).timestamp()}
-        await db.execute("DELETE FROM feed_cache WHERE created < :min_dt", params)
+async def save_to_cache(feed_id, rendered_feed: str, encoded: Dict[str, bytes]):
+    now = dt.datetime.utcnow()
+    async with connect() as db:
+        # Renders of other feeds are expired by `python -m rsstool.maintenance`
+        await db.execute("DELETE FROM feed_cache WHERE feed_id = :id", {"id": feed_id})
 
-        params = {"id": feed_id, "value": rendered_feed, "created": dt.datetime.utcnow().timestamp()}
-        await db.execute("INSERT INTO feed_cache(feed_id, value, created) VALUES (:id, :value, :created)", params)
+        params = {"id": feed_id, "created": now.timestamp(), **{enc: encoded.get(enc) for enc in CACHE_ENCODINGS}}
+        await db.execute(
+            """INSERT INTO feed_cache(feed_id, value, created, value_gzip, value_br, value_zstd)
+            VALUES (:id, NULL, :created, :gzip, :br, :zstd)""",
+            params,
+        )
         await db.commit()
+    return CachedFeed(value=rendered_feed, created=now, encoded=encoded)
 
 
 Feed = namedtuple("Feed", ["feed_id", "type", "config", "last_accessed", "created"])
 
 
 async def insert_feed(feed_id: str, type: str, config: Dict, created: Optional[dt.datetime] = None):
+    await insert_feeds([(feed_id, type, config)], created)
+
+
+async def insert_feeds(feeds: List[Tuple[str, str, Dict]], created: Optional[dt.datetime] = None):
     if created is None:
         created = dt.datetime.utcnow()
 
-    async with asql.connect(DB_LOC) as db:
-        params = {
-            "id": feed_id,
-            "type": type,
-            "config": json.dumps(config),
-            "last_accessed": None,
-            "created": created.timestamp(),
-            "deleted": 0,
-        }
-        await db.execute(
+    async with connect() as db:
+        # IMMEDIATE takes the write lock up front, so concurrent writers wait out DB_TIMEOUT instead of failing with
+        # "database is locked" when their read lock can't be upgraded
+        await db.execute("BEGIN IMMEDIATE")
+        all_params = [
+            {
+                "id": feed_id,
+                "type": type,
+                "config": json.dumps(config),
+                "last_accessed": None,
+                "created": created.timestamp(),
+                "deleted": 0,
+            }
+            for feed_id, type, config in feeds
+        ]
+        await db.executemany(
             """INSERT INTO feed(id, type, config, last_accessed, created, deleted) VALUES (
             :id, :type, :config, :last_accessed, :created, :deleted
         )""",
-            params,
+            all_params,
         )
         await db.commit()
 
 
+def feed_from_row(row) -> Feed:
+    return Feed(
+        feed_id=row[0],
+        type=row[1],
+        config=json.loads(row[2]),
+        last_accessed=None if not row[3] else dt.datetime.utcfromtimestamp(row[3]),
+        created=dt.datetime.utcfromtimestamp(row[4]),
+    )
+
+
+async def get_feeds_of_type(type: str) -> List[Feed]:
+    async with connect() as db:
+        async with db.execute(
+            "SELECT id, type, config, last_accessed, created FROM feed WHERE type = :type AND deleted = 0",
+            {"type": type},
+        ) as cursor:
+            return [feed_from_row(row) async for row in cursor]
+
+
 async def get_feed(feed_id) -> Optional[Feed]:
-    async with asql.connect(DB_LOC) as db:
+    async with connect() as db:
+        await _check_feeds_generation(db)
+        if feed_id in _feeds:
+            return _feeds[feed_id]
+
         params = {"id": feed_id}
         async with db.execute(
             "SELECT id, type, config, last_accessed, created FROM feed WHERE id = :id AND deleted = 0 LIMIT 1", params
         ) as cursor:
             async for row in cursor:
-                return Feed(
-                    feed_id=row[0],
-                    type=row[1],
-                    config=json.loads(row[2]),
-                    last_accessed=None if not row[3] else dt.datetime.utcfromtimestamp(row[3]),
-                    created=dt.datetime.utcfromtimestamp(row[4]),
-                )
+                feed = feed_from_row(row)
+                _feeds[feed_id] = feed
+                return feed
     return None
 
 
+# Access times are buffered and written in batches, so serving a feed doesn't take the write lock on every request
+_pending_accesses = {}
+_accesses_flushed = 0.0
+
+
 async def record_feed_access(feed_id: str):
-    async with asql.connect(DB_LOC) as db:
-        params = {"id": feed_id, "now": dt.datetime.utcnow().timestamp()}
-        await db.execute("UPDATE feed SET last_accessed = :now WHERE id = :id", params)
+    global _accesses_flushed
+
+    _pending_accesses[feed_id] = dt.datetime.utcnow().timestamp()
+    now = time.monotonic()
+    if now - _accesses_flushed < COHERENCE_INTERVAL:
+        return
+    _accesses_flushed = now
+    await flush_feed_accesses()
+
+
+async def flush_feed_accesses():
+    all_params = [{"id": feed_id, "now": accessed} for feed_id, accessed in _pending_accesses.items()]
+    _pending_accesses.clear()
+    if not all_params:
+        return
+    async with connect() as db:
+        await db.executemany("UPDATE feed SET last_accessed = :now WHERE id = :id", all_params)
         await db.commit()
 
 
@@ -90,8 +190,10 @@ FeedItem = namedtuple(
 
 
 async def insert_feed_items(feed_items: List[FeedItem]):
-    async with asql.connect(DB_LOC) as db:
-        await db.execute("BEGIN")
+    async with connect() as db:
+        # IMMEDIATE takes the write lock up front, so concurrent writers wait out DB_TIMEOUT instead of failing with
+        # "database is locked" when their read lock can't be upgraded
+        await db.execute("BEGIN IMMEDIATE")
         all_params = [
             {
                 "id": fi.id,
@@ -106,9 +208,11 @@ async def insert_feed_items(feed_items: List[FeedItem]):
             }
             for fi in feed_items
         ]
+        # Links archived by rsstool.maintenance stay archived even if the upstream still lists them
         await db.executemany(
             """INSERT INTO feed_item(id, feed_id, link, title, author, categories, publish_date, click_count, score)
-            VALUES (:id, :feed_id, :link, :title, :author, :categories, :publish_date, :click_count, :score)
+            SELECT :id, :feed_id, :link, :title, :author, :categories, :publish_date, :click_count, :score
+            WHERE NOT EXISTS (SELECT 1 FROM feed_item_archive WHERE feed_id = :feed_id AND link = :link)
             ON CONFLICT(feed_id, link) DO UPDATE SET
               title = excluded.title,
               author = excluded.author,
@@ -121,9 +225,14 @@ async def insert_feed_items(feed_items: List[FeedItem]):
         scored_items = [i for i in feed_items if i.score is not None]
         if scored_items:
             score_time = dt.datetime.utcnow().timestamp()
-            all_params = [{"item_id": i.id, "score": i.score, "time_scored": score_time} for i in scored_items]
+            # Looked up by (feed_id, link): items that were already stored keep their original id
+            all_params = [
+                {"feed_id": i.feed_id, "link": i.link, "score": i.score, "time_scored": score_time}
+                for i in scored_items
+            ]
             await db.executemany(
-                "INSERT INTO feed_item_score(item_id, score, time_scored) VALUES (:item_id, :score, :time_scored)",
+                """INSERT INTO feed_item_score(item_id, score, time_scored)
+                SELECT id, :score, :time_scored FROM feed_item WHERE feed_id = :feed_id AND link = :link""",
                 all_params,
             )
         await db.commit()
@@ -146,7 +255,7 @@ async def _get_link(feed_id: str, item_id: str, db):
 
 
 async def record_click_and_get_link(feed_id: str, item_id: str):
-    async with asql.connect(DB_LOC) as db:
+    async with connect() as db:
         tasks = [
             asyncio.ensure_future(_increment_click_count(feed_id, item_id, db)),
             asyncio.ensure_future(_get_link(feed_id, item_id, db)),
@@ -185,7 +294,45 @@ async def _get_feed_items_in_window(db, feed_id: str, start: dt.datetime, end: d
     return all_items
 
 
-async def get_windowed_items(feed: Feed, limit: int = 10):
+async def search_feed_items(query: str, limit: int) -> List[FeedItem]:
+    """Newest `limit` items of any live digest feed whose title, author or categories match the FTS5 `query`. An item
+    indexed by several feeds is returned once."""
+    params = {"query": query, "limit": limit}
+    all_items = []
+    async with connect() as db:
+        async with db.execute(
+            """SELECT id, feed_id, link, title, author, categories, publish_date, click_count, score
+            FROM (
+              SELECT fi.*, ROW_NUMBER() OVER (PARTITION BY fi.link ORDER BY fi.click_count DESC) AS n
+              FROM feed_item_fts
+              JOIN feed_item_doc d ON d.doc = feed_item_fts.rowid
+              JOIN feed_item fi ON fi.id = d.item_id
+              JOIN feed f ON f.id = fi.feed_id AND f.deleted = 0
+              WHERE feed_item_fts MATCH :query
+            )
+            WHERE n = 1
+            ORDER BY CAST(publish_date AS REAL) DESC
+            LIMIT :limit""",
+            params,
+        ) as cursor:
+            async for row in cursor:
+                all_items.append(
+                    FeedItem(
+                        id=row[0],
+                        feed_id=row[1],
+                        link=row[2],
+                        title=row[3],
+                        author=row[4],
+                        categories=json.loads(row[5]),
+                        publish_date=dt.datetime.utcfromtimestamp(float(row[6])),
+                        click_count=row[7],
+                        score=row[8],
+                    )
+                )
+    return all_items
+
+
+def get_digest_windows(feed: Feed, limit: int = 10) -> List[Tuple[dt.datetime, dt.datetime]]:
     if feed.type != "digest":
         raise ValueError("can only get windowed items for digest feeds")
 
@@ -201,14 +348,67 @@ async def get_windowed_items(feed: Feed, limit: int = 10):
     # TODO what if < 1?
 
     first_window_start = start + (windows_completed - limit) * window_size
-    window_dates = [
-        (first_window_start + i * window_size, first_window_start + (i + 1) * window_size) for i in range(limit)
-    ]
-    async with asql.connect(DB_LOC) as db:
-        tasks = [asyncio.ensure_future(_get_feed_items_in_window(db, feed.feed_id, s, e)) for s, e in window_dates]
+    return [(first_window_start + i * window_size, first_window_start + (i + 1) * window_size) for i in range(limit)]
+
+
+async def get_items_in_windows(feed_id: str, windows: List[Tuple[dt.datetime, dt.datetime]]):
+    async with connect() as db:
+        tasks = [asyncio.ensure_future(_get_feed_items_in_window(db, feed_id, s, e)) for s, e in windows]
         results = await asyncio.gather(*tasks)
 
-    return {wd[0]: r for wd, r in zip(window_dates, results)}
+    return {wd[0]: r for wd, r in zip(windows, results)}
+
+
+async def get_windowed_items(feed: Feed, limit: int = 10):
+    return await get_items_in_windows(feed.feed_id, get_digest_windows(feed, limit))
+
+
+async def get_cached_digest_windows(
+    feed_id: str, windows: List[Tuple[dt.datetime, dt.datetime]]
+) -> Dict[dt.datetime, Optional[Dict]]:
+    """Cached digest entries by window start. None means the window is known to be empty; windows that aren't
+    cached (or were cached with different bounds) are left out."""
+    if not windows:
+        return {}
+    by_start = {s.timestamp(): (s, e) for s, e in windows}
+    cached = {}
+    async with connect() as db:
+        params = {"feed_id": feed_id, "first": min(by_start), "last": max(by_start)}
+        async with db.execute(
+            """SELECT window_start, window_end, value
+            FROM digest_window_cache
+            WHERE feed_id = :feed_id AND window_start >= :first AND window_start <= :last""",
+            params,
+        ) as cursor:
+            async for row in cursor:
+                window = by_start.get(row[0])
+                if window is not None and window[1].timestamp() == row[1]:
+                    cached[window[0]] = None if row[2] is None else json.loads(row[2])
+    return cached
+
+
+async def save_digest_windows(feed_id: str, entries: List[Tuple[dt.datetime, dt.datetime, Optional[Dict]]]):
+    async with connect() as db:
+        all_params = [
+            {
+                "feed_id": feed_id,
+                "window_start": start.timestamp(),
+                "window_end": end.timestamp(),
+                "value": None if entry is None else json.dumps(entry),
+                "created": dt.datetime.utcnow().timestamp(),
+            }
+            for start, end, entry in entries
+        ]
+        await db.executemany(
+            """INSERT INTO digest_window_cache(feed_id, window_start, window_end, value, created)
+            VALUES (:feed_id, :window_start, :window_end, :value, :created)
+            ON CONFLICT(feed_id, window_start) DO UPDATE SET
+              window_end = excluded.window_end,
+              value = excluded.value,
+              created = excluded.created""",
+            all_params,
+        )
+        await db.commit()
 
 
 async def update_digest_meta(feed: Feed, title, description):
@@ -216,7 +416,31 @@ async def update_digest_meta(feed: Feed, title, description):
         return
 
     new_config = {**feed.config, "title": title, "description": description}
-    async with asql.connect(DB_LOC) as db:
+    async with connect() as db:
         params = {"config": json.dumps(new_config), "id": feed.feed_id}
         await db.execute("UPDATE feed SET config = :config WHERE id = :id", params)
         await db.commit()
+    _feeds[feed.feed_id] = feed._replace(config=new_config)
+
+
+async def try_acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    """Claims `name` for `owner` until it is released or `ttl` seconds pass. Used so that only one worker process
+    runs a given piece of background work."""
+    now = dt.datetime.utcnow().timestamp()
+    async with connect() as db:
+        params = {"name": name, "owner": owner, "now": now, "expires": now + ttl}
+        cursor = await db.execute(
+            """INSERT INTO lease(name, owner, expires) VALUES (:name, :owner, :expires)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires
+            WHERE lease.expires < :now OR lease.owner = :owner""",
+            params,
+        )
+        acquired = cursor.rowcount > 0
+        await db.commit()
+    return acquired
+
+
+async def release_lease(name: str, owner: str):
+    async with connect() as db:
+        await db.execute("DELETE FROM lease WHERE name = :name AND owner = :owner", {"name": name, "owner": owner})
+        await db.commit()
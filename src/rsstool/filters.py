@@ -0,0 +1,128 @@
+from typing import Dict, Iterable, Optional, List
+import functools
+import json
+import re
+
+
+def _node_regex(node: Dict) -> str:
+    branches = [re.escape(char) + _node_regex(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    # Greedy, so the match at any position is the longest keyword starting there
+    return f"(?:{body})?" if "" in node else body
+
+
+def trie_regex(words: Iterable[str]) -> str:
+    """Builds a regex matching any of `words` with common prefixes factored out, so matching doesn't re-try every
+    keyword at every position of the text"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+    return _node_regex(trie)
+
+
+# Below this many keywords, plain substring checks beat the regex machinery
+MIN_KEYWORDS_FOR_REGEX = 5
+
+
+class KeywordMatcher:
+    """Case-insensitive substring matching of many keywords in one pass over the text"""
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = frozenset(kw.lower() for kw in keywords)
+        self._use_regex = bool(self.keywords) and len(self.keywords) >= MIN_KEYWORDS_FOR_REGEX
+        pattern = trie_regex(self.keywords)
+        self._any = re.compile(pattern)
+        self._at_each_position = re.compile(f"(?=({pattern}))")
+
+    @functools.cached_property
+    def _contained(self) -> Dict[str, frozenset]:
+        # Only the longest keyword at each position gets reported, so finding it also finds every keyword inside it
+        return {kw: frozenset(other for other in self.keywords if other in kw) for kw in self.keywords}
+
+    def any_in(self, text: str) -> bool:
+        text = text.lower()
+        if not self._use_regex:
+            return any(kw in text for kw in self.keywords)
+        return self._any.search(text) is not None
+
+    def all_in(self, text: str) -> bool:
+        text = text.lower()
+        if not self._use_regex:
+            return all(kw in text for kw in self.keywords)
+        missing = set(self.keywords)
+        if not missing:
+            return True
+        for match in self._at_each_position.finditer(text):
+            missing -= self._contained[match.group(1)]
+            if not missing:
+                return True
+        return False
+
+
+class FeedFilter:
+    """Compiled form of a 'filter' feed config. Only configured rules are checked.
+
+    - `require_in_*`: every keyword must appear; `disallow_in_*`: none may appear (case-insensitive substrings)
+    - `require_*_regex`: every pattern must match; `disallow_*_regex`: none may match (case-insensitive)
+    - `require_author` / `require_category`: at least one must match; `disallow_*`: none may match. Authors match on
+      substrings, categories on the whole (case-insensitive) term.
+    """
+
+    def __init__(self, config: Dict):
+        self.rules = []
+        for field in ("title", "description"):
+            self._add_keyword_rules(field, config.get(f"require_in_{field}"), config.get(f"disallow_in_{field}"))
+            self._add_regex_rules(field, config.get(f"require_{field}_regex"), config.get(f"disallow_{field}_regex"))
+
+        if config.get("require_author"):
+            required_authors = KeywordMatcher(config["require_author"])
+            self.rules.append(lambda e: required_authors.any_in(e["author"]))
+        if config.get("disallow_author"):
+            disallowed_authors = KeywordMatcher(config["disallow_author"])
+            self.rules.append(lambda e: not disallowed_authors.any_in(e["author"]))
+
+        self._uses_categories = bool(config.get("require_category") or config.get("disallow_category"))
+        if config.get("require_category"):
+            required_categories = frozenset(c.lower() for c in config["require_category"])
+            self.rules.append(lambda e: not required_categories.isdisjoint(e["categories"]))
+        if config.get("disallow_category"):
+            disallowed_categories = frozenset(c.lower() for c in config["disallow_category"])
+            self.rules.append(lambda e: disallowed_categories.isdisjoint(e["categories"]))
+
+    def _add_keyword_rules(self, field: str, required: Optional[List[str]], disallowed: Optional[List[str]]):
+        if required:
+            required_matcher = KeywordMatcher(required)
+            self.rules.append(lambda e: required_matcher.all_in(e[field]))
+        if disallowed:
+            disallowed_matcher = KeywordMatcher(disallowed)
+            self.rules.append(lambda e: not disallowed_matcher.any_in(e[field]))
+
+    def _add_regex_rules(self, field: str, required: Optional[List[str]], disallowed: Optional[List[str]]):
+        if required:
+            required_patterns = [re.compile(p, re.IGNORECASE) for p in required]
+            self.rules.append(lambda e: all(p.search(e[field]) for p in required_patterns))
+        if disallowed:
+            disallowed_patterns = [re.compile(p, re.IGNORECASE) for p in disallowed]
+            self.rules.append(lambda e: not any(p.search(e[field]) for p in disallowed_patterns))
+
+    def matches(self, title: str = "", description: str = "", author: str = "", categories: Iterable[str] = ()) -> bool:
+        if not self.rules:
+            return True
+        entry = {"title": title or "", "description": description or "", "author": author or ""}
+        if self._uses_categories:
+            entry["categories"] = {c.lower() for c in categories}
+        return all(rule(entry) for rule in self.rules)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(config_json: str) -> FeedFilter:
+    return FeedFilter(json.loads(config_json))
+
+
+def for_config(config: Dict) -> FeedFilter:
+    return _compile(json.dumps(config, sort_keys=True))
@@ -1,35 +1,49 @@
 import uuid
 import json
-import pickle
 from typing import Dict, List
 import itertools as it
 import datetime as dt
 import time
 import logging
 import os
+import socket
 import asyncio
+import xml.etree.ElementTree as ET
+import argparse
+from collections import namedtuple, defaultdict
+from urllib.parse import urlparse
 
-import pandas as pd
 from fastapi import BackgroundTasks
-import aiohttp as ahttp
 import PyRSS2Gen as rss
-import feedparser
 
-from rsstool.constants import DB_LOC, MODELS_LOC
+from rsstool.constants import (
+    DB_LOC,
+    CACHE_SOFT_TTL,
+    CACHE_HARD_TTL,
+    CACHE_STALE_IF_ERROR_TTL,
+    INDEX_CONCURRENCY,
+    INDEX_PER_HOST_CONCURRENCY,
+    LEASE_TTL,
+)
 import rsstool.db_helper as db
 import rsstool.models as mdl
-import rsstool.ml_base as mlb
+import rsstool.filters as filters
+import rsstool.compression as compression
+import rsstool.scoring as scoring
+from rsstool.sources import get_source, close_session
 
-HEADERS = {"user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:95.0) Gecko/20100101 Firefox/95.0"}
 LOG = logging.getLogger(__name__)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def combined_feed_config(request: mdl.CreateCombinedFeedRequest) -> Dict:
+    return {"sources": request.sources, "title": request.title, "description": request.description}
 
 
 async def make_combined_feed(request: mdl.CreateCombinedFeedRequest, _: BackgroundTasks):
     # TODO validate feed sources
     feed_id = str(uuid.uuid4())
-    await db.insert_feed(
-        feed_id, request.type, {"sources": request.sources, "title": request.title, "description": request.description}
-    )
+    await db.insert_feed(feed_id, request.type, combined_feed_config(request))
     return mdl.FeedResponse(url=f"/api/v1/feed/{feed_id}")
 
 
@@ -66,11 +80,6 @@ def build_entries(entries):
         )
 
 
-async def fetch_feed(session, url) -> str:
-    async with session.get(url) as response:
-        return await response.text()
-
-
 def build_link(feed: db.Feed):
     return "http://" + os.getenv("VIRTUAL_HOST", "localhost:8000") + "/api/v1/feed/" + feed.feed_id
 
@@ -81,12 +90,17 @@ def build_item_link(feed_item: db.FeedItem):
 
 
 async def render_combined_feed(feed: db.Feed, _: BackgroundTasks):
-    bodies = []
-    async with ahttp.ClientSession(headers=HEADERS) as session:
-        tasks = [asyncio.ensure_future(fetch_feed(session, url)) for url in feed.config["sources"]]
-        bodies = await asyncio.gather(*tasks)
+    tasks = [asyncio.ensure_future(get_source(url)) for url in feed.config["sources"]]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Render whatever answered in time; only fail (and fall back to the cache) if nothing did
+    failures = [(url, r) for url, r in zip(feed.config["sources"], results) if isinstance(r, Exception)]
+    if failures and len(failures) == len(results):
+        raise failures[0][1]
+    for url, error in failures:
+        LOG.warning(f"Leaving {url} out of {feed.feed_id}: {error!r}")
 
-    feeds = [feedparser.parse(b) for b in bodies]
+    feeds = [r.parsed for r in results if not isinstance(r, Exception)]
     all_items = sorted(it.chain.from_iterable(build_entries(f["entries"]) for f in feeds), key=lambda ri: ri.pubDate)
     return rss.RSS2(
         title=feed.config.get("title", "A combined feed"),
@@ -98,18 +112,14 @@ async def render_combined_feed(feed: db.Feed, _: BackgroundTasks):
 
 
 async def render_filtered_feed(feed: db.Feed, _: BackgroundTasks) -> str:
-    async with ahttp.ClientSession(headers=HEADERS) as session:
-        body = await fetch_feed(session, feed.config["source"])
-    parsed_feed = feedparser.parse(body)
+    source = await get_source(feed.config["source"])
+    parsed_feed = source.parsed
+    feed_filter = filters.for_config(feed.config)
     filtered_items = []
     for entry in parsed_feed["entries"]:
-        if feed.config["require_in_title"] and any(
-            kw.lower() not in entry["title"].lower() for kw in feed.config["require_in_title"]
-        ):
-            continue
-        if feed.config["disallow_in_title"] and any(
-            kw.lower() in entry["title"].lower() for kw in feed.config["disallow_in_title"]
-        ):
+        description = get_description(entry)
+        categories = [tag["term"] for tag in entry.get("tags", [])]
+        if not feed_filter.matches(entry.get("title"), description, entry.get("author"), categories):
             continue
 
         link = entry.get("link")
@@ -121,9 +131,9 @@ async def render_filtered_feed(feed: db.Feed, _: BackgroundTasks) -> str:
             rss.RSSItem(
                 title=entry.get("title"),
                 link=link,
-                description=get_description(entry),
+                description=description,
                 author=entry["author"],
-                categories=[tag["term"] for tag in entry.get("tags", [])],
+                categories=categories,
                 pubDate=datetime_from_struct_time(entry["published_parsed"]),
                 source=None,
             )
@@ -143,24 +153,39 @@ def _render_one_item(item: db.FeedItem):
     return f'<li>{item.publish_date} - <a href="{build_item_link(item)}">{item.title}</a> ({item.author})</li>'
 
 
-def build_digest_entry(feed: db.Feed, window_start: dt.datetime, items_in_window: List[db.FeedItem]):
+def digest_entry_fields(feed: db.Feed, window_start: dt.datetime, items_in_window: List[db.FeedItem]) -> Dict:
+    """Everything in a digest entry besides its date, in a form that can be stored as JSON"""
     content = "<p><ul>" + "".join(_render_one_item(i) for i in items_in_window) + "</ul></p>"
     combined_authors = ", ".join(frozenset(i.author or "Unknown author" for i in items_in_window))
-    combined_categories = frozenset(it.chain.from_iterable(i.categories for i in items_in_window))
-    return rss.RSSItem(
-        title=f"Digest for {window_start}",
-        link=build_link(feed),
-        guid=f"{feed.feed_id}-{window_start:%Y%m%d%H%M%S}",
-        description=content,
-        author=combined_authors,
-        categories=combined_categories,
-        pubDate=window_start,
-        source=None,
-    )
+    combined_categories = sorted(frozenset(it.chain.from_iterable(i.categories for i in items_in_window)))
+    return {
+        "title": f"Digest for {window_start}",
+        "link": build_link(feed),
+        "guid": f"{feed.feed_id}-{window_start:%Y%m%d%H%M%S}",
+        "description": content,
+        "author": combined_authors,
+        "categories": combined_categories,
+    }
+
+
+def build_digest_entry(feed: db.Feed, window_start: dt.datetime, items_in_window: List[db.FeedItem]):
+    return rss.RSSItem(**digest_entry_fields(feed, window_start, items_in_window), pubDate=window_start, source=None)
 
 
 async def render_digest_feed(feed: db.Feed, bg: BackgroundTasks) -> str:
-    windows = await db.get_windowed_items(feed)
+    # Windows are complete once they show up here, so their entries are cached and only re-rendered after the
+    # digest_window_cache triggers drop them (new, changed or rescored items in the window)
+    windows = db.get_digest_windows(feed)
+    entries = await db.get_cached_digest_windows(feed.feed_id, windows)
+    missing = [(start, end) for start, end in windows if start not in entries]
+    if missing:
+        items_by_window = await db.get_items_in_windows(feed.feed_id, missing)
+        new_entries = [
+            (start, end, digest_entry_fields(feed, start, items_by_window[start]) if items_by_window[start] else None)
+            for start, end in missing
+        ]
+        await db.save_digest_windows(feed.feed_id, new_entries)
+        entries.update((start, entry) for start, _, entry in new_entries)
     bg.add_task(index_source, feed.feed_id)
 
     feed_title = feed.config.get("title", "an RSS feed")
@@ -170,91 +195,137 @@ async def render_digest_feed(feed: db.Feed, bg: BackgroundTasks) -> str:
         description=feed.config.get("description", None),
         lastBuildDate=dt.datetime.utcnow(),
         items=[
-            build_digest_entry(feed, window_start, items_in_window)
-            for window_start, items_in_window in windows.items()
-            if items_in_window
+            rss.RSSItem(**entries[window_start], pubDate=window_start, source=None)
+            for window_start, _ in windows
+            if entries[window_start] is not None
+        ],
+    ).to_xml()
+
+
+async def render_search_feed(feed: db.Feed, _: BackgroundTasks) -> str:
+    # Answered from feed_item_fts, which is filled as digest feeds are indexed; no upstream is fetched. Links go
+    # straight to the article: a click here says nothing about the digest the item was indexed for, so it must not
+    # count towards that digest's model.
+    items = await db.search_feed_items(feed.config["query"], feed.config.get("limit", 50))
+    return rss.RSS2(
+        title=feed.config.get("title", "A search feed"),
+        link=build_link(feed),
+        description=feed.config.get("description", None),
+        lastBuildDate=dt.datetime.utcnow(),
+        items=[
+            rss.RSSItem(
+                title=item.title,
+                link=item.link,
+                guid=rss.Guid(item.link),
+                author=item.author,
+                categories=item.categories,
+                pubDate=item.publish_date,
+                source=None,
+            )
+            for item in items
         ],
     ).to_xml()
 
 
-async def render_feed(feed_id, bg: BackgroundTasks, skipcache: bool) -> str:
+FEED_RENDERERS = {
+    "combine": render_combined_feed,
+    "filter": render_filtered_feed,
+    "digest": render_digest_feed,
+    "search": render_search_feed,
+}
+_refreshing = set()
+
+
+async def render_and_cache(feed: db.Feed, bg: BackgroundTasks) -> db.CachedFeed:
+    handler = FEED_RENDERERS.get(feed.type)
+    if handler is None:
+        raise RuntimeError(f"Cannot render '{feed.type}' feed")
+
+    rendered_feed = await handler(feed, bg)
+    # Compressed once here so every reader of the cached render gets the stored bytes
+    encoded = await asyncio.get_running_loop().run_in_executor(None, compression.compress_all, rendered_feed)
+    return await db.save_to_cache(feed.feed_id, rendered_feed, encoded)
+
+
+async def run_elected(name: str, fn, *args):
+    """Runs `fn` unless the job called `name` is already running, in this or another worker process"""
+    # Unique per call, so two runs in the same process don't both hold the lease
+    owner = f"{WORKER_ID}:{uuid.uuid4()}"
+    if not await db.try_acquire_lease(name, owner, LEASE_TTL):
+        LOG.info(f"Skipping {name}, it is already running")
+        return
+    try:
+        await fn(*args)
+    finally:
+        await db.release_lease(name, owner)
+
+
+async def _refresh_feed(feed_id: str):
+    feed = await db.get_feed(feed_id)
+    if feed is None:
+        return
+    bg = BackgroundTasks()
+    await render_and_cache(feed, bg)
+    await bg()
+
+
+async def refresh_feed(feed_id: str):
+    try:
+        await run_elected(f"refresh:{feed_id}", _refresh_feed, feed_id)
+    except Exception:
+        LOG.exception(f"Background refresh of {feed_id} failed")
+    finally:
+        _refreshing.discard(feed_id)
+
+
+async def render_feed(feed_id, bg: BackgroundTasks, skipcache: bool) -> db.CachedFeed:
     tasks = [
-        asyncio.ensure_future(db.maybe_get_cache(feed_id, skipcache)),
+        asyncio.ensure_future(db.maybe_get_cache(feed_id, skipcache, max(CACHE_HARD_TTL, CACHE_STALE_IF_ERROR_TTL))),
         asyncio.ensure_future(db.record_feed_access(feed_id)),
     ]
     # The order of result values corresponds to the order of awaitables
     # https://docs.python.org/3/library/asyncio-task.html#asyncio.gather
-    cached_value, _ = await asyncio.gather(*tasks)
-    if cached_value is not None:
-        return cached_value
+    cached, _ = await asyncio.gather(*tasks)
+    if cached is not None:
+        age = (dt.datetime.utcnow() - cached.created).total_seconds()
+        if age < CACHE_SOFT_TTL:
+            return cached
+        if age < CACHE_HARD_TTL:
+            if feed_id not in _refreshing:
+                _refreshing.add(feed_id)
+                bg.add_task(refresh_feed, feed_id)
+            return cached
 
     feed = await db.get_feed(feed_id)
     if feed is None:
         raise mdl.FeedNotFound()
 
-    handlers = {
-        "combine": render_combined_feed,
-        "filter": render_filtered_feed,
-        "digest": render_digest_feed,
-    }
-    handler = handlers.get(feed.type)
-    if handler is None:
-        raise RuntimeError(f"Cannot render '{feed.type}' feed")
+    try:
+        rendered = await render_and_cache(feed, bg)
+    except Exception:
+        if cached is None or age >= CACHE_STALE_IF_ERROR_TTL:
+            raise
+        LOG.exception(f"Rendering {feed_id} failed, serving render from {cached.created}")
+        return cached
+    return rendered
 
-    rendered_feed = await handler(feed, bg)
-    await db.save_to_cache(feed_id, rendered_feed)
-    return rendered_feed
 
+def filtered_feed_config(request: mdl.CreateFilteredFeedRequest) -> Dict:
+    return request.dict(exclude={"type"})
 
-async def make_filtered_feed(request: mdl.CreateCombinedFeedRequest, _: BackgroundTasks):
+
+async def make_filtered_feed(request: mdl.CreateFilteredFeedRequest, _: BackgroundTasks):
     feed_id = str(uuid.uuid4())
-    await db.insert_feed(
-        feed_id,
-        request.type,
-        {
-            "source": request.source,
-            "disallow_in_title": request.disallow_in_title,
-            "require_in_title": request.require_in_title,
-        },
-    )
+    await db.insert_feed(feed_id, request.type, filtered_feed_config(request))
     return mdl.FeedResponse(url=f"/api/v1/feed/{feed_id}")
 
 
-def maybe_load_model(feed: db.Feed):
-    try:
-        with open(os.path.join(MODELS_LOC, feed.feed_id + ".pkl"), "rb") as f:
-            model_with_meta = pickle.load(f)
-        return model_with_meta["model"]
-    except (FileNotFoundError,):
-        return None
-
-
-def score_items(items: List[db.FeedItem], model):
-    df = pd.DataFrame(
-        [
-            {
-                "title": i.title,
-                "categories": i.categories,
-                "author": i.author,
-                "link": i.link,
-            }
-            for i in items
-        ]
-    )
-    scores = model.predict_proba(df)[:, 1]
-    return [i._replace(score=score) for i, score in zip(items, scores)]
-
-
 async def index_source(feed_id: str):
-    feed = await db.get_feed(feed_id)
-    if feed.type != "digest":
-        raise ValueError("can only index 'digest' feeds")
+    await run_elected(f"index:{feed_id}", _index_source, feed_id)
 
-    async with ahttp.ClientSession(headers=HEADERS) as session:
-        body = await fetch_feed(session, feed.config["source"])
-    parsed_feed = feedparser.parse(body)
 
-    feed_items = [
+def build_feed_items(feed_id: str, parsed_feed) -> List[db.FeedItem]:
+    return [
         db.FeedItem(
             id=str(uuid.uuid4()),
             feed_id=feed_id,
@@ -269,9 +340,16 @@ async def index_source(feed_id: str):
         for entry in parsed_feed["entries"]
     ]
 
-    model = maybe_load_model(feed)
-    if model is not None:
-        feed_items = score_items(feed_items, model)
+
+async def _index_source(feed_id: str):
+    feed = await db.get_feed(feed_id)
+    if feed.type != "digest":
+        raise ValueError("can only index 'digest' feeds")
+
+    source = await get_source(feed.config["source"])
+    parsed_feed = source.parsed
+
+    feed_items = scoring.score_feed_items(build_feed_items(feed_id, parsed_feed))
 
     await db.update_digest_meta(
         feed, title=parsed_feed["feed"]["title"], description=parsed_feed["feed"]["description"]
@@ -279,18 +357,108 @@ async def index_source(feed_id: str):
     await db.insert_feed_items(feed_items)
 
 
+IndexSummary = namedtuple("IndexSummary", ["n_feeds", "n_sources", "n_items", "duration", "failures"])
+
+
+async def index_feeds(
+    feeds: List[db.Feed], concurrency: int = INDEX_CONCURRENCY, per_host: int = INDEX_PER_HOST_CONCURRENCY
+) -> IndexSummary:
+    """Indexes many digest feeds at once. Each source is fetched once however many feeds use it, with at most
+    `concurrency` fetches in flight overall and `per_host` per host. Items of all feeds are scored and written in a
+    single batch."""
+    start_ctr = time.perf_counter()
+    feeds_by_source = defaultdict(list)
+    failures = {}
+    for feed in feeds:
+        if feed.type != "digest":
+            failures[feed.feed_id] = f"can only index 'digest' feeds, not '{feed.type}'"
+            continue
+        feeds_by_source[feed.config["source"]].append(feed)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    host_semaphores = defaultdict(lambda: asyncio.Semaphore(per_host))
+    parsed_by_source = {}
+
+    async def fetch_one(url):
+        # Per host first, so a slow host can't hold global slots while waiting on its own limit
+        async with host_semaphores[urlparse(url).netloc], semaphore:
+            try:
+                parsed_by_source[url] = (await get_source(url)).parsed
+            except Exception as e:
+                for feed in feeds_by_source[url]:
+                    failures[feed.feed_id] = repr(e)
+
+    await asyncio.gather(*[fetch_one(url) for url in feeds_by_source])
+
+    all_items = []
+    for url, parsed_feed in parsed_by_source.items():
+        for feed in feeds_by_source[url]:
+            try:
+                all_items.extend(build_feed_items(feed.feed_id, parsed_feed))
+                await db.update_digest_meta(
+                    feed, title=parsed_feed["feed"]["title"], description=parsed_feed["feed"]["description"]
+                )
+            except Exception as e:
+                failures[feed.feed_id] = repr(e)
+
+    if all_items:
+        await db.insert_feed_items(scoring.score_feed_items(all_items))
+
+    return IndexSummary(
+        n_feeds=len(feeds),
+        n_sources=len(feeds_by_source),
+        n_items=len(all_items),
+        duration=time.perf_counter() - start_ctr,
+        failures=failures,
+    )
+
+
+async def index_sources(
+    feed_ids: List[str], concurrency: int = INDEX_CONCURRENCY, per_host: int = INDEX_PER_HOST_CONCURRENCY
+):
+    found = await asyncio.gather(*[db.get_feed(feed_id) for feed_id in feed_ids])
+    summary = await index_feeds([feed for feed in found if feed], concurrency, per_host)
+    failures = {feed_id: "feed not found (unknown or deleted)" for feed_id, feed in zip(feed_ids, found) if not feed}
+    failures.update(summary.failures)
+    for feed_id, error in failures.items():
+        LOG.warning(f"Problem indexing {feed_id}: {error}")
+
+
+async def index_all(concurrency: int = INDEX_CONCURRENCY, per_host: int = INDEX_PER_HOST_CONCURRENCY):
+    summary = await index_feeds(await db.get_feeds_of_type("digest"), concurrency, per_host)
+    n_ok = summary.n_feeds - len(summary.failures)
+    LOG.info(
+        f"Indexed {n_ok}/{summary.n_feeds} feeds from {summary.n_sources} sources ({summary.n_items} items) in "
+        f"{summary.duration:.1f}s: {summary.n_feeds / summary.duration:.1f} feeds/s, "
+        f"{summary.n_items / summary.duration:.1f} items/s"
+    )
+    for feed_id, error in summary.failures.items():
+        LOG.warning(f"Failed to index {feed_id}: {error}")
+    return summary
+
+
+def digest_feed_config(request: mdl.CreateDigestFeedRequest) -> Dict:
+    return {
+        "source": request.source,
+        "cadence": request.cadence,
+        "length": request.length,
+        "start_timestamp": request.start_timestamp,
+    }
+
+
+def search_feed_config(request: mdl.CreateSearchFeedRequest) -> Dict:
+    return request.dict(exclude={"type"})
+
+
+async def make_search_feed(request: mdl.CreateSearchFeedRequest, _: BackgroundTasks):
+    feed_id = str(uuid.uuid4())
+    await db.insert_feed(feed_id, request.type, search_feed_config(request))
+    return mdl.FeedResponse(url=f"/api/v1/feed/{feed_id}")
+
+
 async def make_digest_feed(request: mdl.CreateDigestFeedRequest, bg: BackgroundTasks):
     feed_id = str(uuid.uuid4())
-    await db.insert_feed(
-        feed_id,
-        request.type,
-        {
-            "source": request.source,
-            "cadence": request.cadence,
-            "length": request.length,
-            "start_timestamp": request.start_timestamp,
-        },
-    )
+    await db.insert_feed(feed_id, request.type, digest_feed_config(request))
     bg.add_task(index_source, feed_id)
     return mdl.FeedResponse(url=f"/api/v1/feed/{feed_id}")
 
@@ -300,6 +468,7 @@ def validate_feed_request(r):
         mdl.CreateFilteredFeedRequest: "filter",
         mdl.CreateCombinedFeedRequest: "combine",
         mdl.CreateDigestFeedRequest: "digest",
+        mdl.CreateSearchFeedRequest: "search",
     }
     for request_type, type_value in known_types.items():
         if isinstance(r, request_type):
@@ -317,6 +486,7 @@ async def handle_create_feed_request(request: mdl.CreateFeedRequest, bg: Backgro
         mdl.CreateCombinedFeedRequest: make_combined_feed,
         mdl.CreateFilteredFeedRequest: make_filtered_feed,
         mdl.CreateDigestFeedRequest: make_digest_feed,
+        mdl.CreateSearchFeedRequest: make_search_feed,
     }
     this_handler = None
     for type, handler in handlers.items():
@@ -328,3 +498,73 @@ async def handle_create_feed_request(request: mdl.CreateFeedRequest, bg: Backgro
         raise RuntimeError("cannot handle this feed request")
 
     return await this_handler(request, bg)
+
+
+async def handle_bulk_create_feed_request(requests: List[mdl.CreateFeedRequest], bg: BackgroundTasks):
+    for request in requests:
+        validate_feed_request(request)
+
+    config_builders = {
+        mdl.CreateCombinedFeedRequest: combined_feed_config,
+        mdl.CreateFilteredFeedRequest: filtered_feed_config,
+        mdl.CreateDigestFeedRequest: digest_feed_config,
+        mdl.CreateSearchFeedRequest: search_feed_config,
+    }
+    new_feeds = [(str(uuid.uuid4()), request.type, config_builders[type(request)](request)) for request in requests]
+    await db.insert_feeds(new_feeds)
+
+    # One task for the whole batch so a large import doesn't fan out into hundreds of concurrent fetches
+    digest_ids = [feed_id for feed_id, feed_type, _ in new_feeds if feed_type == "digest"]
+    if digest_ids:
+        bg.add_task(index_sources, digest_ids)
+    return mdl.BulkFeedResponse(urls=[f"/api/v1/feed/{feed_id}" for feed_id, _, _ in new_feeds])
+
+
+def requests_from_opml(opml: bytes, feed_type: str, **options) -> List[mdl.CreateFeedRequest]:
+    """One feed per OPML outline with an `xmlUrl`, or a single feed combining all of them when `feed_type` is
+    'combine'. `options` are passed on to the create request (e.g. cadence for digests)."""
+    try:
+        root = ET.fromstring(opml)
+    except ET.ParseError as e:
+        raise ValueError(f"invalid OPML: {e}")
+    sources = [outline.get("xmlUrl") for outline in root.iter("outline") if outline.get("xmlUrl")]
+    if not sources:
+        raise ValueError("OPML has no outlines with an xmlUrl")
+
+    if feed_type == "combine":
+        title = root.findtext("head/title")
+        if title:
+            options = {"title": title, **options}
+        return [mdl.CreateCombinedFeedRequest(type=feed_type, sources=sources, **options)]
+
+    request_types = {"filter": mdl.CreateFilteredFeedRequest, "digest": mdl.CreateDigestFeedRequest}
+    if feed_type not in request_types:
+        raise ValueError(f"Unknown type {feed_type}")
+    return [request_types[feed_type](type=feed_type, source=source, **options) for source in sources]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    index_parser = subparsers.add_parser("index", help="index digest feeds")
+    index_parser.add_argument("feed_ids", nargs="*")
+    index_parser.add_argument("--all", action="store_true", help="index every digest feed")
+    index_parser.add_argument("--concurrency", type=int, default=INDEX_CONCURRENCY)
+    index_parser.add_argument("--per-host", type=int, default=INDEX_PER_HOST_CONCURRENCY)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.all:
+        job = run_elected("index:all", index_all, args.concurrency, args.per_host)
+    elif args.feed_ids:
+        job = index_sources(args.feed_ids, args.concurrency, args.per_host)
+    else:
+        parser.error("specify feed ids or --all")
+
+    async def main():
+        try:
+            await job
+        finally:
+            await close_session()
+
+    asyncio.run(main())
@@ -5,7 +5,7 @@ import sys
 
 import aiosqlite as asql
 
-from rsstool.constants import DB_LOC
+from rsstool.constants import DB_LOC, DB_TIMEOUT
 
 migrations = {
     "init": [
@@ -69,11 +69,198 @@ migrations = {
     );
         """,
     ],
+    "add_cache_encodings": [
+        """\
+    ALTER TABLE feed_cache ADD COLUMN value_gzip BLOB;
+        """,
+        """\
+    ALTER TABLE feed_cache ADD COLUMN value_br BLOB;
+        """,
+        """\
+    ALTER TABLE feed_cache ADD COLUMN value_zstd BLOB;
+        """,
+    ],
+    "add_coherence": [
+        """\
+    CREATE TABLE cache_generation (
+        name TEXT PRIMARY KEY,
+        value INTEGER
+    ) WITHOUT ROWID;
+        """,
+        """\
+    INSERT INTO cache_generation(name, value) VALUES ('feed', 0);
+        """,
+        """\
+    CREATE TRIGGER feed_generation_update AFTER UPDATE OF type, config, deleted ON feed
+    BEGIN
+        UPDATE cache_generation SET value = value + 1 WHERE name = 'feed';
+    END;
+        """,
+        """\
+    CREATE TRIGGER feed_generation_delete AFTER DELETE ON feed
+    BEGIN
+        UPDATE cache_generation SET value = value + 1 WHERE name = 'feed';
+    END;
+        """,
+        """\
+    CREATE TABLE lease (
+        name TEXT PRIMARY KEY,
+        owner TEXT,
+        expires REAL
+    ) WITHOUT ROWID;
+        """,
+    ],
+    "add_digest_window_cache": [
+        """\
+    CREATE TABLE digest_window_cache (
+        feed_id TEXT,
+        window_start REAL,
+        window_end REAL,
+        value TEXT,
+        created INTEGER,
+        PRIMARY KEY (feed_id, window_start),
+        FOREIGN KEY(feed_id) REFERENCES feed(id)
+    ) WITHOUT ROWID;
+        """,
+        """\
+    CREATE TRIGGER digest_window_item_insert AFTER INSERT ON feed_item
+    BEGIN
+        DELETE FROM digest_window_cache
+        WHERE feed_id = new.feed_id
+          AND window_start <= CAST(new.publish_date AS REAL) AND window_end > CAST(new.publish_date AS REAL);
+    END;
+        """,
+        """\
+    CREATE TRIGGER digest_window_item_update AFTER UPDATE OF title, author, categories, publish_date, score ON feed_item
+    WHEN old.title IS NOT new.title
+      OR old.author IS NOT new.author
+      OR old.categories IS NOT new.categories
+      OR old.publish_date IS NOT new.publish_date
+      OR old.score IS NOT new.score
+    BEGIN
+        DELETE FROM digest_window_cache
+        WHERE feed_id = new.feed_id
+          AND ((window_start <= CAST(new.publish_date AS REAL) AND window_end > CAST(new.publish_date AS REAL))
+            OR (window_start <= CAST(old.publish_date AS REAL) AND window_end > CAST(old.publish_date AS REAL)));
+    END;
+        """,
+        """\
+    CREATE TRIGGER digest_window_item_delete AFTER DELETE ON feed_item
+    BEGIN
+        DELETE FROM digest_window_cache
+        WHERE feed_id = old.feed_id
+          AND window_start <= CAST(old.publish_date AS REAL) AND window_end > CAST(old.publish_date AS REAL);
+    END;
+        """,
+    ],
+    "add_change_tracking": [
+        """\
+    CREATE TABLE feed_change (
+        feed_id TEXT PRIMARY KEY,
+        n_items INTEGER,
+        n_clicks INTEGER,
+        FOREIGN KEY(feed_id) REFERENCES feed(id)
+    ) WITHOUT ROWID;
+        """,
+        """\
+    INSERT INTO feed_change(feed_id, n_items, n_clicks)
+    SELECT feed_id, COUNT(*), COALESCE(SUM(click_count), 0) FROM feed_item GROUP BY feed_id;
+        """,
+        """\
+    CREATE TRIGGER feed_change_item_insert AFTER INSERT ON feed_item
+    BEGIN
+        INSERT INTO feed_change(feed_id, n_items, n_clicks) VALUES (new.feed_id, 1, 0)
+        ON CONFLICT(feed_id) DO UPDATE SET n_items = n_items + 1;
+    END;
+        """,
+        """\
+    CREATE TRIGGER feed_change_item_click AFTER UPDATE OF click_count ON feed_item
+    WHEN new.click_count > old.click_count
+    BEGIN
+        INSERT INTO feed_change(feed_id, n_items, n_clicks) VALUES (new.feed_id, 0, new.click_count - old.click_count)
+        ON CONFLICT(feed_id) DO UPDATE SET n_clicks = n_clicks + excluded.n_clicks;
+    END;
+        """,
+        """\
+    ALTER TABLE train_job ADD COLUMN n_changes INTEGER;
+        """,
+    ],
+    "add_retention": [
+        """\
+    CREATE TABLE feed_item_archive (
+        id TEXT PRIMARY KEY,
+        feed_id TEXT,
+        link TEXT,
+        title TEXT,
+        author TEXT,
+        categories TEXT,
+        publish_date TEXT,
+        click_count INTEGER,
+        score REAL,
+        archived INTEGER,
+        FOREIGN KEY(feed_id) REFERENCES feed(id),
+        UNIQUE (feed_id, link)
+    ) WITHOUT ROWID;
+        """,
+        """\
+    CREATE INDEX feed_item_score_item_id ON feed_item_score(item_id, time_scored);
+        """,
+        """\
+    CREATE INDEX feed_item_feed_id_publish_date ON feed_item(feed_id, publish_date);
+        """,
+    ],
+    "add_search": [
+        # feed_item is WITHOUT ROWID, so FTS rows are tied to items through feed_item_doc instead of rowid
+        """\
+    CREATE TABLE feed_item_doc (
+        doc INTEGER PRIMARY KEY,
+        item_id TEXT UNIQUE,
+        FOREIGN KEY(item_id) REFERENCES feed_item(id)
+    );
+        """,
+        """\
+    CREATE VIRTUAL TABLE feed_item_fts USING fts5(title, author, categories);
+        """,
+        """\
+    INSERT INTO feed_item_doc(item_id) SELECT id FROM feed_item;
+        """,
+        """\
+    INSERT INTO feed_item_fts(rowid, title, author, categories)
+    SELECT d.doc, fi.title, fi.author, fi.categories
+    FROM feed_item fi JOIN feed_item_doc d ON d.item_id = fi.id;
+        """,
+        """\
+    CREATE TRIGGER feed_item_fts_insert AFTER INSERT ON feed_item
+    BEGIN
+        INSERT INTO feed_item_doc(item_id) VALUES (NEW.id);
+        INSERT INTO feed_item_fts(rowid, title, author, categories)
+        SELECT doc, NEW.title, NEW.author, NEW.categories FROM feed_item_doc WHERE item_id = NEW.id;
+    END;
+        """,
+        """\
+    CREATE TRIGGER feed_item_fts_update AFTER UPDATE OF title, author, categories ON feed_item
+    WHEN OLD.title IS NOT NEW.title OR OLD.author IS NOT NEW.author OR OLD.categories IS NOT NEW.categories
+    BEGIN
+        UPDATE feed_item_fts SET title = NEW.title, author = NEW.author, categories = NEW.categories
+        WHERE rowid = (SELECT doc FROM feed_item_doc WHERE item_id = NEW.id);
+    END;
+        """,
+        """\
+    CREATE TRIGGER feed_item_fts_delete AFTER DELETE ON feed_item
+    BEGIN
+        DELETE FROM feed_item_fts WHERE rowid = (SELECT doc FROM feed_item_doc WHERE item_id = OLD.id);
+        DELETE FROM feed_item_doc WHERE item_id = OLD.id;
+    END;
+        """,
+    ],
 }
 
 
 async def run_migrations(names: List[str]):
-    async with asql.connect(DB_LOC) as db:
+    async with asql.connect(DB_LOC, timeout=DB_TIMEOUT) as db:
+        if "init" in names:
+            # Only takes effect before the first table is created; see rsstool.maintenance for existing databases
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
         for name in names:
             queries = ["BEGIN"] + migrations[name] + ["COMMIT"]
             for query in queries:
@@ -89,6 +276,7 @@ if __name__ == "__main__":
             raise RuntimeError("must specify migrations to run")
         asyncio.run(run_migrations(sys.argv[2:]))
     elif len(sys.argv) == 1:
-        asyncio.run(run_migrations(["init"]))
+        # A new database gets the current schema
+        asyncio.run(run_migrations(list(migrations)))
     else:
         raise RuntimeError("not sure what you are trying to do")
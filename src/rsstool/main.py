@@ -1,33 +1,103 @@
-from fastapi import Depends, FastAPI, HTTPException, status, Response, BackgroundTasks
+import time
+from typing import Optional, List
+
+from fastapi import Depends, FastAPI, HTTPException, status, Response, BackgroundTasks, Header, Request
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.responses import RedirectResponse
+from pydantic import PositiveInt, ValidationError
 
-from rsstool.models import FeedResponse, CreateFeedRequest, FeedNotFound
+from rsstool.models import FeedResponse, BulkFeedResponse, CreateFeedRequest, FeedNotFound, CadenceEnum
 import rsstool.helper as helper
 import rsstool.db_helper as db
+import rsstool.compression as compression
+import rsstool.sources as sources
 from rsstool.constants import USERNAME, PASSWORD
 
 app = FastAPI()
 security = HTTPBasic()
 
 
+@app.on_event("startup")
+async def startup():
+    await db.enable_wal()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await db.flush_feed_accesses()
+    await sources.close_session()
+
+
+def check_credentials(credentials: HTTPBasicCredentials):
+    if credentials.username != USERNAME or credentials.password != PASSWORD:  # TODO compare_digest
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
+
+
 @app.post("/api/v1/feed", response_model=FeedResponse, status_code=status.HTTP_201_CREATED)
 async def create_feed(
     request: CreateFeedRequest, bg: BackgroundTasks, credentials: HTTPBasicCredentials = Depends(security)
 ):
-    if credentials.username != USERNAME or credentials.password != PASSWORD:  # TODO compare_digest
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
+    check_credentials(credentials)
     return await helper.handle_create_feed_request(request, bg)
 
 
+@app.post("/api/v1/feeds", response_model=BulkFeedResponse, status_code=status.HTTP_201_CREATED)
+async def create_feeds(
+    requests: List[CreateFeedRequest], bg: BackgroundTasks, credentials: HTTPBasicCredentials = Depends(security)
+):
+    check_credentials(credentials)
+    try:
+        return await helper.handle_bulk_create_feed_request(requests, bg)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+
+@app.post("/api/v1/feeds/opml", response_model=BulkFeedResponse, status_code=status.HTTP_201_CREATED)
+async def import_opml(
+    request: Request,
+    bg: BackgroundTasks,
+    type: str = "digest",
+    cadence: CadenceEnum = CadenceEnum.daily,
+    length: PositiveInt = 1,
+    start_timestamp: Optional[float] = None,
+    credentials: HTTPBasicCredentials = Depends(security),
+):
+    check_credentials(credentials)
+    options = {}
+    if type == "digest":
+        if start_timestamp is None:
+            start_timestamp = time.time()
+        options = {"cadence": cadence, "length": length, "start_timestamp": start_timestamp}
+
+    try:
+        requests = helper.requests_from_opml(await request.body(), type, **options)
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors())
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    return await helper.handle_bulk_create_feed_request(requests, bg)
+
+
 @app.get("/api/v1/feed/{feed_id}")
-async def get_feed(feed_id, bg: BackgroundTasks, skipcache: bool = False):
+async def get_feed(
+    feed_id, bg: BackgroundTasks, skipcache: bool = False, accept_encoding: Optional[str] = Header(None)
+):
     try:
         rendered_feed = await helper.render_feed(feed_id, bg, skipcache)
-        return Response(content=rendered_feed, media_type="application/xml")
     except FeedNotFound:
         raise HTTPException(status_code=404, detail="Feed not found")
 
+    headers = {"Vary": "Accept-Encoding"}
+    encoding = compression.negotiate(accept_encoding, rendered_feed.encoded)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+        return Response(content=rendered_feed.encoded[encoding], media_type="application/xml", headers=headers)
+
+    value = rendered_feed.value
+    if value is None:
+        value = compression.decompress(rendered_feed.encoded)
+    return Response(content=value, media_type="application/xml", headers=headers)
+
 
 @app.get("/api/v1/feed/{feed_id}/item/{item_id}", response_class=RedirectResponse)
 async def get_feed_item(feed_id, item_id):
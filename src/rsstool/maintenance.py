@@ -0,0 +1,204 @@
+"""Retention and compaction, run with `python -m rsstool.maintenance`"""
+import argparse
+import contextlib
+import datetime as dt
+import logging
+import sqlite3
+import time
+from typing import Dict
+
+from rsstool.constants import (
+    DB_LOC,
+    DB_TIMEOUT,
+    SCORE_HISTORY_DAYS,
+    ARCHIVE_MARGIN_DAYS,
+    MAINTENANCE_BATCH_SIZE,
+    INCREMENTAL_VACUUM_PAGES,
+    CACHE_HARD_TTL,
+    CACHE_STALE_IF_ERROR_TTL,
+)
+import rsstool.db_helper as db
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+DAY = 24 * 60 * 60
+
+
+def _delete_in_batches(conn: sqlite3.Connection, table: str, key: str, batch_size: int) -> int:
+    """Deletes the rows of `table` whose `key` is in the temp table `doomed`, committing every `batch_size` rows so
+    that the serving processes are never locked out for long"""
+    total = 0
+    while True:
+        batch = [r[0] for r in conn.execute("SELECT key FROM doomed LIMIT :n", {"n": batch_size}).fetchall()]
+        if not batch:
+            break
+        conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", [(k,) for k in batch])
+        conn.executemany("DELETE FROM doomed WHERE key = ?", [(k,) for k in batch])
+        conn.commit()
+        total += len(batch)
+    return total
+
+
+def _reset_doomed(conn: sqlite3.Connection):
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS doomed (key PRIMARY KEY)")
+    conn.execute("DELETE FROM doomed")
+
+
+def compact_scores(conn: sqlite3.Connection, history_days: float, batch_size: int) -> int:
+    """Keeps the latest score of every item, every score from the last `history_days` and the last score per day
+    before that. Scores of items that no longer exist are dropped."""
+    _reset_doomed(conn)
+    conn.execute(
+        """INSERT INTO doomed(key)
+        SELECT rowid FROM (
+          SELECT rowid, item_id, time_scored,
+            ROW_NUMBER() OVER (PARTITION BY item_id ORDER BY time_scored DESC) AS latest,
+            ROW_NUMBER() OVER (
+              PARTITION BY item_id, CAST(time_scored / :day AS INTEGER) ORDER BY time_scored DESC
+            ) AS in_day
+          FROM feed_item_score
+        )
+        WHERE (latest > 1 AND in_day > 1 AND time_scored < :cutoff)
+          OR item_id NOT IN (SELECT id FROM feed_item)""",
+        {"day": DAY, "cutoff": dt.datetime.utcnow().timestamp() - history_days * DAY},
+    )
+    conn.commit()
+    return _delete_in_batches(conn, "feed_item_score", "rowid", batch_size)
+
+
+def archive_items(conn: sqlite3.Connection, margin_days: float, batch_size: int) -> int:
+    """Moves items that are `margin_days` older than the oldest window their digest shows to feed_item_archive,
+    which is only read for training. Indexing skips archived links, so each link is archived once."""
+    _reset_doomed(conn)
+    rows = conn.execute("SELECT id, type, config, last_accessed, created FROM feed WHERE type = 'digest'").fetchall()
+    for row in rows:
+        feed = db.feed_from_row(row)
+        horizon = db.get_digest_windows(feed)[0][0] - dt.timedelta(days=margin_days)
+        conn.execute(
+            """INSERT INTO doomed(key)
+            SELECT id FROM feed_item WHERE feed_id = :feed_id AND CAST(publish_date AS REAL) < :horizon""",
+            {"feed_id": feed.feed_id, "horizon": horizon.timestamp()},
+        )
+    conn.commit()
+
+    total = 0
+    archived = dt.datetime.utcnow().timestamp()
+    while True:
+        batch = [r[0] for r in conn.execute("SELECT key FROM doomed LIMIT :n", {"n": batch_size}).fetchall()]
+        if not batch:
+            break
+        params = [{"id": k, "archived": archived} for k in batch]
+        conn.executemany(
+            """INSERT INTO feed_item_archive(
+              id, feed_id, link, title, author, categories, publish_date, click_count, score, archived
+            )
+            SELECT id, feed_id, link, title, author, categories, publish_date, click_count, score, :archived
+            FROM feed_item WHERE id = :id
+            ON CONFLICT(feed_id, link) DO UPDATE SET
+              title = excluded.title,
+              author = excluded.author,
+              categories = excluded.categories,
+              publish_date = excluded.publish_date,
+              click_count = MAX(feed_item_archive.click_count, excluded.click_count),
+              score = excluded.score,
+              archived = excluded.archived""",
+            params,
+        )
+        conn.executemany("DELETE FROM feed_item_score WHERE item_id = :id", params)
+        conn.executemany("DELETE FROM feed_item WHERE id = :id", params)
+        conn.executemany("DELETE FROM doomed WHERE key = :id", params)
+        conn.commit()
+        total += len(batch)
+    return total
+
+
+def expire_caches(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Drops renders that can no longer be served, digest windows that have scrolled off their feed and expired
+    leases"""
+    now = dt.datetime.utcnow().timestamp()
+    counts = {}
+    cur = conn.execute(
+        """DELETE FROM feed_cache
+        WHERE created < :min_dt
+          OR rowid NOT IN (SELECT MAX(rowid) FROM feed_cache GROUP BY feed_id)""",
+        {"min_dt": now - max(CACHE_HARD_TTL, CACHE_STALE_IF_ERROR_TTL)},
+    )
+    counts["feed_cache"] = cur.rowcount
+
+    counts["digest_window_cache"] = conn.execute(
+        "DELETE FROM digest_window_cache WHERE feed_id IN (SELECT id FROM feed WHERE deleted != 0)"
+    ).rowcount
+    rows = conn.execute(
+        "SELECT id, type, config, last_accessed, created FROM feed WHERE type = 'digest' AND deleted = 0"
+    ).fetchall()
+    for row in rows:
+        feed = db.feed_from_row(row)
+        first_start = db.get_digest_windows(feed)[0][0]
+        counts["digest_window_cache"] += conn.execute(
+            "DELETE FROM digest_window_cache WHERE feed_id = :feed_id AND window_start < :start",
+            {"feed_id": feed.feed_id, "start": first_start.timestamp()},
+        ).rowcount
+
+    counts["lease"] = conn.execute("DELETE FROM lease WHERE expires < :now", {"now": now}).rowcount
+    conn.commit()
+    return counts
+
+
+def incremental_vacuum(conn: sqlite3.Connection, pages: int) -> int:
+    """Hands up to `pages` free pages back to the filesystem (all of them if 0). Returns the number of free pages
+    before vacuuming."""
+    (auto_vacuum,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+    (free_pages,) = conn.execute("PRAGMA freelist_count").fetchone()
+    if auto_vacuum != 2:
+        LOG.warning("auto_vacuum is not INCREMENTAL, run with --setup-incremental-vacuum once to enable it")
+        return free_pages
+    # executescript steps the pragma to completion; execute() would free a single page
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return free_pages
+
+
+def setup_incremental_vacuum(conn: sqlite3.Connection):
+    """auto_vacuum can only be changed on an existing database by rebuilding it, which locks it for the duration"""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def run_maintenance(
+    db_loc: str = DB_LOC,
+    history_days: float = SCORE_HISTORY_DAYS,
+    margin_days: float = ARCHIVE_MARGIN_DAYS,
+    batch_size: int = MAINTENANCE_BATCH_SIZE,
+    vacuum_pages: int = INCREMENTAL_VACUUM_PAGES,
+):
+    with contextlib.closing(sqlite3.connect(db_loc, timeout=DB_TIMEOUT)) as conn:
+        start = time.perf_counter()
+        n_archived = archive_items(conn, margin_days, batch_size)
+        LOG.info(f"Archived {n_archived} items in {time.perf_counter() - start:.02f}s")
+
+        start = time.perf_counter()
+        n_scores = compact_scores(conn, history_days, batch_size)
+        LOG.info(f"Deleted {n_scores} scores in {time.perf_counter() - start:.02f}s")
+
+        counts = expire_caches(conn)
+        LOG.info(f"Expired {counts}")
+
+        free_pages = incremental_vacuum(conn, vacuum_pages)
+        (remaining,) = conn.execute("PRAGMA freelist_count").fetchone()
+        LOG.info(f"Reclaimed {free_pages - remaining} of {free_pages} free pages")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply retention policies and reclaim space")
+    parser.add_argument("--history-days", type=float, default=SCORE_HISTORY_DAYS)
+    parser.add_argument("--margin-days", type=float, default=ARCHIVE_MARGIN_DAYS)
+    parser.add_argument("--batch-size", type=int, default=MAINTENANCE_BATCH_SIZE)
+    parser.add_argument("--vacuum-pages", type=int, default=INCREMENTAL_VACUUM_PAGES)
+    parser.add_argument("--setup-incremental-vacuum", action="store_true")
+    args = parser.parse_args()
+
+    if args.setup_incremental_vacuum:
+        with contextlib.closing(sqlite3.connect(DB_LOC, timeout=DB_TIMEOUT)) as conn:
+            setup_incremental_vacuum(conn)
+    run_maintenance(DB_LOC, args.history_days, args.margin_days, args.batch_size, args.vacuum_pages)
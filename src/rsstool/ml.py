@@ -23,8 +23,9 @@ import scipy.stats as st
 import pandas as pd
 import numpy as np
 
-from rsstool.constants import DB_LOC, MODELS_LOC
+from rsstool.constants import DB_LOC, MODELS_LOC, RETRAIN_MIN_CHANGES
 import rsstool.ml_base as mlb
+import rsstool.scoring as scoring
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 LOG = logging.getLogger(__name__)
@@ -36,15 +37,24 @@ EPSILON = 1e-6
 def get_training_data(db_loc: str = DB_LOC) -> pd.DataFrame:
     rows = []
     cols = []
+    # Items archived by rsstool.maintenance are still training data; a link in both tables counts once
     query = """
     select *, click_count > 0 as has_clicks
-    from feed_item
+    from (
+      select id, feed_id, link, title, author, categories, publish_date, click_count, score from feed_item
+      union all
+      select id, feed_id, link, title, author, categories, publish_date, click_count, score from feed_item_archive a
+      where not exists (select 1 from feed_item fi where fi.feed_id = a.feed_id and fi.link = a.link)
+    )
     where publish_date < :max_dt
     """
 
     with sqlite3.connect(db_loc) as conn:
         with contextlib.closing(conn.cursor()) as c:
-            for row in c.execute("select max(publish_date) from feed_item"):
+            for row in c.execute(
+                "select max(publish_date) from (select publish_date from feed_item "
+                "union all select publish_date from feed_item_archive)"
+            ):
                 max_pub_date = float(row[0])
             for row in c.execute(query, {"max_dt": max_pub_date - 24 * 60 * 60}):
                 rows.append(row)
@@ -125,15 +135,24 @@ def get_coef_ct(est, effectively_zero=EPSILON):
 def store_meta(meta, db_loc: str = DB_LOC):
     params = {
         k: meta[k]
-        for k in ["feed_id", "git_sha", "train_start", "train_duration", "n_rows", "n_positives", "best_score"]
+        for k in [
+            "feed_id",
+            "git_sha",
+            "train_start",
+            "train_duration",
+            "n_rows",
+            "n_positives",
+            "best_score",
+            "n_changes",
+        ]
     }
     params["nonzero_coef_ct"] = meta["coef_ct"]["nonzero"]
     params["best_params"] = json.dumps(meta["best_params"])
     with sqlite3.connect(db_loc) as conn:
         with contextlib.closing(conn.cursor()) as c:
             c.execute(
-                """INSERT INTO train_job(feed_id, git_sha, train_start, train_duration, n_rows, n_positives, nonzero_coef_ct, best_params, best_score)
-                    VALUES (:feed_id, :git_sha, :train_start, :train_duration, :n_rows, :n_positives, :nonzero_coef_ct, :best_params, :best_score)""",
+                """INSERT INTO train_job(feed_id, git_sha, train_start, train_duration, n_rows, n_positives, nonzero_coef_ct, best_params, best_score, n_changes)
+                    VALUES (:feed_id, :git_sha, :train_start, :train_duration, :n_rows, :n_positives, :nonzero_coef_ct, :best_params, :best_score, :n_changes)""",
                 params,
             )
 
@@ -152,18 +171,43 @@ def get_git_hash():
     return git_hash
 
 
-def build_all_models(n_iter, n_jobs):
+def get_change_counts(db_loc: str = DB_LOC):
+    """Per feed: (changes so far, changes as of the last successful train or None), where changes = items + clicks"""
+    query = """
+    select fc.feed_id
+      , fc.n_items + fc.n_clicks
+      , (select tj.n_changes from train_job tj where tj.feed_id = fc.feed_id order by tj.train_start desc limit 1)
+    from feed_change fc
+    """
+    with sqlite3.connect(db_loc) as conn:
+        with contextlib.closing(conn.cursor()) as c:
+            return {row[0]: (row[1], row[2]) for row in c.execute(query)}
+
+
+def build_all_models(n_iter, n_jobs, min_changes=None):
+    """Trains a model for every feed with enough data. With `min_changes`, feeds that got fewer new items + clicks
+    than that since their last train are skipped. Returns why each skipped feed was skipped."""
     LOG.info(f"Building models with {n_iter} iters, {n_jobs} jobs")
     start_time = dt.datetime.utcnow().timestamp()
+    # Read before the training data, so changes that land mid-run count towards the next run
+    change_counts = get_change_counts()
     feed_items = get_training_data()
     git_hash = get_git_hash()
     feed_info = feed_items.groupby("feed_id")["has_clicks"].agg(["mean", "count"])
+    skipped = {}
 
-    for feed_id, count in feed_info["count"].iteritems():
+    for feed_id, count in feed_info["count"].items():
         if count < MIN_ITEMS_FOR_MODEL:
-            LOG.info(f"Skipping training for {feed_id} (not enough data)")
+            skipped[feed_id] = f"not enough data ({count} < {MIN_ITEMS_FOR_MODEL} items)"
             continue
 
+        n_changes, n_changes_at_last_train = change_counts.get(feed_id, (None, None))
+        if min_changes is not None and n_changes is not None and n_changes_at_last_train is not None:
+            new_changes = n_changes - n_changes_at_last_train
+            if new_changes < min_changes:
+                skipped[feed_id] = f"unchanged ({new_changes} < {min_changes} new items + clicks since last train)"
+                continue
+
         in_df = feed_items.query("feed_id == @feed_id")
 
         start_ctr = time.perf_counter()
@@ -171,6 +215,7 @@ def build_all_models(n_iter, n_jobs):
             model = build_model(feed_id, in_df, n_iter=n_iter, n_jobs=n_jobs)
         except:
             LOG.exception(f"Problem building model for {feed_id}")
+            skipped[feed_id] = "training failed"
             continue
 
         meta = {
@@ -184,11 +229,17 @@ def build_all_models(n_iter, n_jobs):
             "n_iter": n_iter,
             "best_params": model.best_params_,
             "best_score": model.best_score_,
+            "n_changes": n_changes,
         }
         store_meta(meta)
         with open(os.path.join(MODELS_LOC, f"{feed_id}.pkl"), "wb") as f:
             pickle.dump({"model": model, "meta": meta}, f)
 
+    LOG.info(f"Trained {len(feed_info) - len(skipped)} of {len(feed_info)} feeds")
+    for feed_id, reason in skipped.items():
+        LOG.info(f"Skipped {feed_id}: {reason}")
+    return skipped
+
 
 def describe_all_models():
     for fn in os.listdir(MODELS_LOC):
@@ -200,11 +251,57 @@ def describe_all_models():
         LOG.info("")
 
 
+def rescore_all(feed_ids=None, db_loc: str = DB_LOC):
+    """Re-scores every stored item of each feed (default: all feeds with a model), e.g. after a retrain"""
+    if not feed_ids:
+        feed_ids = [fn[: -len(".pkl")] for fn in os.listdir(MODELS_LOC) if fn.endswith(".pkl")]
+
+    score_time = dt.datetime.utcnow().timestamp()
+    with sqlite3.connect(db_loc) as conn:
+        with contextlib.closing(conn.cursor()) as c:
+            for feed_id in feed_ids:
+                model = scoring.load_model(feed_id)
+                if model is None:
+                    LOG.info(f"Skipping rescoring for {feed_id} (no model)")
+                    continue
+
+                rows = c.execute(
+                    "select id, title, categories, author, link from feed_item where feed_id = :feed_id",
+                    {"feed_id": feed_id},
+                ).fetchall()
+                if not rows:
+                    continue
+                columns = {
+                    "title": [r[1] for r in rows],
+                    "categories": [json.loads(r[2]) for r in rows],
+                    "author": [r[3] for r in rows],
+                    "link": [r[4] for r in rows],
+                }
+                start_ctr = time.perf_counter()
+                scores = scoring.predict(model, columns)
+
+                all_params = [{"id": r[0], "score": score, "time_scored": score_time} for r, score in zip(rows, scores)]
+                c.executemany("update feed_item set score = :score where id = :id", all_params)
+                c.executemany(
+                    "insert into feed_item_score(item_id, score, time_scored) values (:id, :score, :time_scored)",
+                    all_params,
+                )
+                conn.commit()
+                LOG.info(f"Rescored {len(rows)} items for {feed_id} in {time.perf_counter() - start_ctr:.02f}s")
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "train":
+        args = sys.argv[2:]
+        min_changes = None
+        if "--changed-only" in args:
+            args.remove("--changed-only")
+            min_changes = RETRAIN_MIN_CHANGES
         n_iter, n_jobs = 10, 2
-        if len(sys.argv) > 3:
-            n_iter, n_jobs = int(sys.argv[2]), int(sys.argv[3])
-        build_all_models(n_iter, n_jobs)
+        if len(args) > 1:
+            n_iter, n_jobs = int(args[0]), int(args[1])
+        build_all_models(n_iter, n_jobs, min_changes)
+    elif len(sys.argv) > 1 and sys.argv[1] == "rescore":
+        rescore_all(sys.argv[2:])
     else:
         describe_all_models()
@@ -1,16 +1,28 @@
 from enum import Enum
 from typing import Union, List
-from pydantic import BaseModel, PositiveInt
+import contextlib
+import re
+import sqlite3
+
+from pydantic import BaseModel, PositiveInt, validator
 
 
 class FeedNotFound(Exception):
     """Unable to find feed"""
 
 
+class SourceUnavailable(Exception):
+    """Upstream source is being skipped because its host keeps failing"""
+
+
 class FeedResponse(BaseModel):
     url: str
 
 
+class BulkFeedResponse(BaseModel):
+    urls: List[str]
+
+
 class BaseCreateFeedRequest(BaseModel):
     type: str
 
@@ -27,6 +39,30 @@ class CreateFilteredFeedRequest(BaseCreateFeedRequest):
     source: str
     require_in_title: List[str] = []
     disallow_in_title: List[str] = []
+    require_in_description: List[str] = []
+    disallow_in_description: List[str] = []
+    require_title_regex: List[str] = []
+    disallow_title_regex: List[str] = []
+    require_description_regex: List[str] = []
+    disallow_description_regex: List[str] = []
+    require_author: List[str] = []
+    disallow_author: List[str] = []
+    require_category: List[str] = []
+    disallow_category: List[str] = []
+
+    @validator(
+        "require_title_regex",
+        "disallow_title_regex",
+        "require_description_regex",
+        "disallow_description_regex",
+        each_item=True,
+    )
+    def check_regex(cls, v):
+        try:
+            re.compile(v)
+        except re.error as e:
+            raise ValueError(f"invalid regex {v!r}: {e}")
+        return v
 
 
 class CadenceEnum(str, Enum):
@@ -43,4 +79,25 @@ class CreateDigestFeedRequest(BaseCreateFeedRequest):
     start_timestamp: float
 
 
-CreateFeedRequest = Union[CreateCombinedFeedRequest, CreateDigestFeedRequest, CreateFilteredFeedRequest]
+class CreateSearchFeedRequest(BaseCreateFeedRequest):
+    type = "search"
+    query: str
+    title: str = "A search feed"
+    description: str = "Items from all digest feeds matching a search"
+    limit: PositiveInt = 50
+
+    @validator("query")
+    def check_query(cls, v):
+        # Parsed against an empty table with the same columns as feed_item_fts, so column filters are checked too
+        try:
+            with contextlib.closing(sqlite3.connect(":memory:")) as conn:
+                conn.execute("CREATE VIRTUAL TABLE q USING fts5(title, author, categories)")
+                conn.execute("SELECT * FROM q WHERE q MATCH ?", (v,)).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"invalid search query {v!r}: {e}")
+        return v
+
+
+CreateFeedRequest = Union[
+    CreateCombinedFeedRequest, CreateDigestFeedRequest, CreateFilteredFeedRequest, CreateSearchFeedRequest
+]
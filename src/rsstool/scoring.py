@@ -0,0 +1,65 @@
+from typing import Dict, List
+from collections import defaultdict
+import os
+import pickle
+
+from rsstool.constants import MODELS_LOC
+import rsstool.db_helper as db
+
+FEATURE_COLUMNS = ["title", "categories", "author", "link"]
+
+# feed_id -> (model file mtime, model), so a retrained model is picked up without restarting
+_models = {}
+
+
+def load_model(feed_id: str):
+    path = os.path.join(MODELS_LOC, feed_id + ".pkl")
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        _models.pop(feed_id, None)
+        return None
+
+    cached = _models.get(feed_id)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    # Unpickling the first model is what loads sklearn (via rsstool.ml_base) into a serving process
+    with open(path, "rb") as f:
+        model = pickle.load(f)["model"]
+    _models[feed_id] = (mtime, model)
+    return model
+
+
+def feature_columns(items: List[db.FeedItem]) -> Dict[str, list]:
+    return {
+        "title": [i.title for i in items],
+        "categories": [i.categories for i in items],
+        "author": [i.author for i in items],
+        "link": [i.link for i in items],
+    }
+
+
+def predict(model, columns: Dict[str, list]) -> List[float]:
+    # Imported here so serving feeds doesn't pay for loading pandas unless a model is actually in use
+    import pandas as pd
+
+    return model.predict_proba(pd.DataFrame(columns, columns=FEATURE_COLUMNS))[:, 1].tolist()
+
+
+def score_feed_items(items: List[db.FeedItem]) -> List[db.FeedItem]:
+    """Scores items from any number of feeds, with one prediction per feed that has a model. Items of feeds without
+    a model are returned unchanged."""
+    positions_by_feed = defaultdict(list)
+    for position, item in enumerate(items):
+        positions_by_feed[item.feed_id].append(position)
+
+    scored = list(items)
+    for feed_id, positions in positions_by_feed.items():
+        model = load_model(feed_id)
+        if model is None:
+            continue
+        scores = predict(model, feature_columns([items[p] for p in positions]))
+        for position, score in zip(positions, scores):
+            scored[position] = items[position]._replace(score=score)
+    return scored
@@ -0,0 +1,154 @@
+from collections import namedtuple, OrderedDict, defaultdict
+from urllib.parse import urlparse
+import asyncio
+import logging
+import time
+
+import aiohttp as ahttp
+import feedparser
+
+from rsstool.constants import (
+    SOURCE_CACHE_TTL,
+    SOURCE_CACHE_SIZE,
+    FETCH_TIMEOUT_MIN,
+    FETCH_TIMEOUT_MAX,
+    FETCH_TIMEOUT_LATENCY_MULTIPLE,
+    CIRCUIT_ERROR_RATE,
+    CIRCUIT_COOLDOWN,
+)
+import rsstool.models as mdl
+
+HEADERS = {"user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:95.0) Gecko/20100101 Firefox/95.0"}
+LOG = logging.getLogger(__name__)
+EWMA_WEIGHT = 0.3
+
+Source = namedtuple("Source", ["url", "body", "parsed", "fetched"])
+
+# Keyed by URL. `_inflight` makes concurrent readers of the same URL share a single fetch.
+_cache = OrderedDict()
+_inflight = {}
+# Shared fetches outlive the reader that started them, so they run on a session owned by this module
+_session = None
+_session_loop = None
+
+
+class HostHealth:
+    """Latency and error rate (both EWMAs) of one upstream host, and its circuit breaker.
+
+    The circuit opens once the error rate reaches CIRCUIT_ERROR_RATE. After CIRCUIT_COOLDOWN seconds it goes
+    half-open and lets a single probe through, which either closes it again or re-opens it.
+    """
+
+    def __init__(self):
+        self.latency = None
+        self.error_rate = 0.0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probing = False
+
+    def deadline(self) -> float:
+        if self.latency is None:
+            return FETCH_TIMEOUT_MAX
+        return min(FETCH_TIMEOUT_MAX, max(FETCH_TIMEOUT_MIN, self.latency * FETCH_TIMEOUT_LATENCY_MULTIPLE))
+
+    def allow_request(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= CIRCUIT_COOLDOWN:
+            self.state = "half-open"
+        if self.state == "half-open" and not self.probing:
+            self.probing = True
+            return True
+        return self.state == "closed"
+
+    def record_success(self, latency: float):
+        self.latency = latency if self.latency is None else EWMA_WEIGHT * latency + (1 - EWMA_WEIGHT) * self.latency
+        self.error_rate = (1 - EWMA_WEIGHT) * self.error_rate
+        self.state = "closed"
+        self.probing = False
+
+    def record_failure(self):
+        self.error_rate = EWMA_WEIGHT + (1 - EWMA_WEIGHT) * self.error_rate
+        self.probing = False
+        if self.state == "half-open" or (self.state == "closed" and self.error_rate >= CIRCUIT_ERROR_RATE):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+_hosts = defaultdict(HostHealth)
+
+
+def _get_session() -> ahttp.ClientSession:
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = ahttp.ClientSession(headers=HEADERS)
+        _session_loop = loop
+    return _session
+
+
+async def close_session():
+    global _session, _session_loop
+    if _session is not None and _session_loop is asyncio.get_running_loop():
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+
+async def fetch_feed(session, url) -> str:
+    async with session.get(url) as response:
+        response.raise_for_status()
+        return await response.text()
+
+
+async def _fetch_and_parse(session, url, health: HostHealth) -> Source:
+    start = time.monotonic()
+    healthy = False
+    try:
+        body = await asyncio.wait_for(fetch_feed(session, url), health.deadline())
+        healthy = True
+    except ahttp.ClientResponseError as e:
+        # A 4xx is a problem with this URL, not a sign the host is struggling
+        healthy = e.status < 500
+        raise
+    finally:
+        if healthy:
+            health.record_success(time.monotonic() - start)
+        else:
+            health.record_failure()
+            if health.state == "open":
+                LOG.warning(f"Circuit open for {urlparse(url).netloc} (error rate {health.error_rate:.2f})")
+
+    source = Source(url=url, body=body, parsed=feedparser.parse(body), fetched=time.monotonic())
+    _cache[url] = source
+    _cache.move_to_end(url)
+    while len(_cache) > SOURCE_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return source
+
+
+async def get_source(url) -> Source:
+    """Fetched and parsed `url`, shared with other readers for SOURCE_CACHE_TTL seconds. If the host is failing, an
+    expired copy is returned when there is one; otherwise the error (or SourceUnavailable) is raised."""
+    cached = _cache.get(url)
+    if cached is not None and time.monotonic() - cached.fetched < SOURCE_CACHE_TTL:
+        _cache.move_to_end(url)
+        return cached
+
+    pending = _inflight.get(url)
+    if pending is None:
+        health = _hosts[urlparse(url).netloc]
+        if not health.allow_request():
+            if cached is not None:
+                return cached
+            raise mdl.SourceUnavailable(f"Circuit open for {urlparse(url).netloc}")
+        pending = asyncio.ensure_future(_fetch_and_parse(_get_session(), url, health))
+        pending.add_done_callback(lambda _: _inflight.pop(url, None))
+        _inflight[url] = pending
+
+    try:
+        # Shielded so one reader going away doesn't cancel the fetch for everyone else
+        return await asyncio.shield(pending)
+    except Exception:
+        if cached is None:
+            raise
+        LOG.warning(f"Fetching {url} failed, using copy from {time.monotonic() - cached.fetched:.0f}s ago")
+        return cached
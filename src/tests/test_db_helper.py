@@ -0,0 +1,72 @@
+import asyncio
+import datetime as dt
+import uuid
+
+import pytest
+
+import rsstool.db_helper as db
+import rsstool.initdb as initdb
+
+
+def _setup_db(tmp_path, monkeypatch, wal=False):
+    db_loc = str(tmp_path / "rss.db")
+    monkeypatch.setattr(db, "DB_LOC", db_loc)
+    monkeypatch.setattr(initdb, "DB_LOC", db_loc)
+    asyncio.run(initdb.run_migrations(list(initdb.migrations)))
+    if wal:
+        asyncio.run(db.enable_wal())
+
+
+def _items(feed_id, n):
+    return [
+        db.FeedItem(
+            id=str(uuid.uuid4()),
+            feed_id=feed_id,
+            link=f"https://example.com/{feed_id}/{i}",
+            title=f"Item {i}",
+            author="someone",
+            categories=["news"],
+            publish_date=dt.datetime(2022, 1, 1) + dt.timedelta(hours=i),
+            click_count=0,
+            score=0.5,
+        )
+        for i in range(n)
+    ]
+
+
+@pytest.mark.parametrize("wal", [False, True])
+def test_parallel_insert_feed_items(tmp_path, monkeypatch, wal):
+    _setup_db(tmp_path, monkeypatch, wal)
+    feed_ids = [f"feed{i}" for i in range(8)]
+
+    async def run():
+        await db.insert_feeds([(feed_id, "digest", {"source": feed_id}) for feed_id in feed_ids])
+        await asyncio.gather(*[db.insert_feed_items(_items(feed_id, 200)) for feed_id in feed_ids])
+        return await db.search_feed_items("item", 10_000)
+
+    assert len(asyncio.run(run())) == 8 * 200
+
+
+@pytest.mark.parametrize("wal", [False, True])
+def test_parallel_insert_feeds(tmp_path, monkeypatch, wal):
+    _setup_db(tmp_path, monkeypatch, wal)
+
+    async def run():
+        await asyncio.gather(*[db.insert_feeds([(str(uuid.uuid4()), "digest", {"source": str(i)})]) for i in range(8)])
+        return await db.get_feeds_of_type("digest")
+
+    assert len(asyncio.run(run())) == 8
+
+
+def test_search_skips_deleted_feeds(tmp_path, monkeypatch):
+    _setup_db(tmp_path, monkeypatch)
+
+    async def run():
+        await db.insert_feeds([("live", "digest", {"source": "a"}), ("gone", "digest", {"source": "b"})])
+        await db.insert_feed_items(_items("live", 3) + _items("gone", 3))
+        async with db.connect() as conn:
+            await conn.execute("UPDATE feed SET deleted = 1 WHERE id = 'gone'")
+            await conn.commit()
+        return await db.search_feed_items("item", 100)
+
+    assert {item.feed_id for item in asyncio.run(run())} == {"live"}